@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+# This script builds lots of versions of the Tower of Hanoi animation (different heights,
+# frame rates, numbers of towers, disc textures...) in one go, in a single Blender session:
+#   blender --background tower_of_hanoi.blend --python batch_hanoi.py -- --jobs jobs.jsonl
+#
+# Starting Blender and loading tower_of_hanoi.blend and its textures takes far longer than
+# building a small animation, so instead of starting Blender once per version, we load the
+# file once and, between jobs, put the scene back the way it was in place: the discs' location
+# F-curves are emptied out (the actions themselves are kept and reused), the discs go back to
+# where they started, and the text object from the last job is deleted.
+#
+# The jobs file has one JSON object per line, and anything left out gets the same default
+# as tower_of_hanoi.py's own options.  A job with any other setting in it fails:
+#   {"name": "five", "height": 5, "backend": "sparse", "save": "/tmp/five.blend"}
+#   {"height": 4, "pegs": 4, "frame_rate": 12, "output": "//renders/four_"}
+#   {"height": 12, "frame_budget": 2400, "image": "rusted_metal.jpg", "output": "//renders/twelve_"}
+#
+#   name:         what to call it in the report (default "job <number>").
+#   height, frame_rate, pegs, backend, frame_budget, cache: the same as in tower_of_hanoi.py.
+#   image:        a texture for the discs (from next to the .blend file).  Discs with a texture
+#                 are always made by build_discs().
+#   save:         save a copy of the .blend file here.
+#   output:       render the animation to this path.
+#
+# Each job's time (putting the scene back, building the animation, saving and rendering) is
+# printed as it finishes, and written as JSON lines to --report if that is given.  A job
+# that fails is reported and the rest still run.
+
+here = os.path.dirname(os.path.abspath(__file__))
+if here not in sys.path:
+    sys.path.insert(0, here)
+
+import tower_of_hanoi
+
+job_defaults = {"height": 3, "frame_rate": 24, "pegs": 3, "backend": "per_move", "frame_budget": None,
+                "cache": None, "image": None, "save": None, "output": None}
+
+# batch_scene keeps track of the discs in the scene from one job to the next.
+#
+# The discs that came with the .blend file are kept for any job with the same number of discs
+# (and no image).  Other jobs get discs from build_discs(); while those are in use, the
+# original discs are renamed to "<name>_original" and hidden, so they're out of the way
+# but can come back later.  Made discs are kept for the next job too if it wants the same ones.
+class batch_scene:
+    def __init__(self):
+        self.bpy = tower_of_hanoi.import_bpy()
+        self.bpy.context.scene.frame_set(0)
+
+        self.original_locations = []
+        while self.bpy.data.objects.get(tower_of_hanoi.disc_name(len(self.original_locations) + 1)) is not None:
+            location = self.bpy.data.objects[tower_of_hanoi.disc_name(len(self.original_locations) + 1)].location
+            self.original_locations.append((location.x, location.y, location.z))
+        if self.original_locations:
+            self.bottom = self.original_locations[-1]
+        else:
+            self.bottom = (0.0, 0.0, 0.0)
+
+        # (height, disc thickness, image) for the discs build_discs() made, or None while the
+        # original discs are in use.
+        self.made_discs = None
+        self.hanoi_object = None
+
+    # Gets the scene ready for a job of "height" discs with "geometry", and returns how
+    # many seconds that took.
+    def reset(self, height, geometry, image):
+        start_time = time.perf_counter()
+        bpy = self.bpy
+
+        # Take away what the last job's hanoi() added.
+        if self.hanoi_object is not None:
+            if self.hanoi_object.captions is not None:
+                self.hanoi_object.captions.remove()
+            text = self.hanoi_object.ob
+            curve = text.data
+            bpy.data.objects.remove(text, do_unlink=True)
+            bpy.data.curves.remove(curve)
+            self.hanoi_object = None
+        bpy.context.scene.frame_set(0)
+
+        if height == len(self.original_locations) and image is None:
+            if self.made_discs is not None:
+                self.remove_made_discs()
+                self.show_original_discs(True)
+            locations = self.original_locations
+        else:
+            wanted = (height, geometry.disc_thickness, image)
+            if self.made_discs != wanted:
+                if self.made_discs is None:
+                    self.show_original_discs(False)
+                else:
+                    self.remove_made_discs()
+                tower_of_hanoi.build_discs(height, geometry, self.bottom)
+                if image is not None:
+                    material = tower_of_hanoi.disc_material("hanoi_disc_" + os.path.splitext(os.path.basename(image))[0],
+                                                            image)
+                    for disc in range(1, height + 1):
+                        bpy.data.objects[tower_of_hanoi.disc_name(disc)].material_slots[0].material = material
+                self.made_discs = wanted
+            locations = [(self.bottom[0], self.bottom[1], self.bottom[2] + geometry.slot_z[height - disc])
+                         for disc in range(1, height + 1)]
+
+        for disc in range(1, len(locations) + 1):
+            disc_object = bpy.data.objects[tower_of_hanoi.disc_name(disc)]
+            clear_location_fcurves(disc_object)
+            disc_object.location = locations[disc - 1]
+
+        return time.perf_counter() - start_time
+
+    def remove_made_discs(self):
+        bpy = self.bpy
+        for disc in range(1, self.made_discs[0] + 1):
+            disc_object = bpy.data.objects[tower_of_hanoi.disc_name(disc)]
+            action = disc_object.animation_data.action if disc_object.animation_data is not None else None
+            bpy.data.objects.remove(disc_object, do_unlink=True)
+            if action is not None and action.users == 0:
+                bpy.data.actions.remove(action)
+        self.made_discs = None
+
+    def show_original_discs(self, show):
+        for disc in range(1, len(self.original_locations) + 1):
+            name = tower_of_hanoi.disc_name(disc)
+            disc_object = self.bpy.data.objects[name + "_original" if show else name]
+            disc_object.name = name if show else name + "_original"
+            disc_object.hide_render = not show
+            # hide_viewport is Blender 2.8 and up, hide is before that.
+            if hasattr(disc_object, "hide_viewport"):
+                disc_object.hide_viewport = not show
+            else:
+                disc_object.hide = not show
+
+# Empties out an object's location F-curves, keeping its action so the next job's
+# keyframes go straight back into it.
+def clear_location_fcurves(disc_object):
+    if disc_object.animation_data is None or disc_object.animation_data.action is None:
+        return
+    fcurves = disc_object.animation_data.action.fcurves
+    for fcurve in [fcurve for fcurve in fcurves if fcurve.data_path == "location"]:
+        fcurves.remove(fcurve)
+
+# Runs one job and returns its line of the report.
+def run_job(scene, number, job):
+    bpy = scene.bpy
+    settings = dict(job_defaults)
+    settings.update(job)
+    report = {"job": number, "name": settings.get("name", "job " + str(number)), "height": settings["height"]}
+
+    start_time = time.perf_counter()
+    try:
+        # Anything we don't know about (a typo like "frame-rate", or an option like "captions"
+        # that jobs don't have) would otherwise just be left out, so it fails the job instead.
+        unknown = sorted(set(job) - set(job_defaults) - {"name"})
+        if unknown:
+            raise ValueError("unknown job settings: " + ", ".join(unknown))
+
+        problem = tower_of_hanoi.animation_options_problem(settings["pegs"], settings["backend"],
+                                                           settings["frame_budget"], cache=settings["cache"])
+        if problem is not None:
+            raise ValueError(problem)
+
+        height = settings["height"]
+        geometry = tower_of_hanoi.tower_geometry(height, pole_x=tuple(5 * peg for peg in range(settings["pegs"])))
+        report["reset_seconds"] = scene.reset(height, geometry, settings["image"])
+
+        build_start_time = time.perf_counter()
+        hanoi_object = tower_of_hanoi.hanoi(height, geometry, settings["frame_rate"], settings["pegs"])
+        scene.hanoi_object = hanoi_object
+        tower_of_hanoi.build_animation(hanoi_object, height, settings["backend"], settings["pegs"],
+                                       settings["frame_budget"], settings["cache"])
+        report["build_seconds"] = time.perf_counter() - build_start_time
+        report["moves"] = hanoi_object.iter_count
+
+        output_start_time = time.perf_counter()
+        bpy.context.scene.frame_start = 0
+        bpy.context.scene.frame_end = hanoi_object.frame_count
+        if settings["save"]:
+            # copy=True leaves the session pointing at tower_of_hanoi.blend, so "//" paths in
+            # the next job still mean the same folder.
+            bpy.ops.wm.save_as_mainfile(filepath=settings["save"], copy=True)
+        if settings["output"]:
+            bpy.context.scene.render.filepath = settings["output"]
+            bpy.ops.render.render(animation=True)
+        report["output_seconds"] = time.perf_counter() - output_start_time
+    except Exception as error:
+        report["error"] = repr(error)
+    report["seconds"] = time.perf_counter() - start_time
+    return report
+
+def read_jobs(jobs_path):
+    jobs = []
+    with open(jobs_path) as jobs_file:
+        for line in jobs_file:
+            if line.strip():
+                jobs.append(json.loads(line))
+    return jobs
+
+def main(arguments=None):
+    if arguments is None:
+        if "--" in sys.argv:
+            arguments = sys.argv[sys.argv.index("--") + 1:]
+        else:
+            arguments = []
+
+    parser = argparse.ArgumentParser(prog="batch_hanoi.py",
+                                     description="Build many Tower of Hanoi animations in one Blender session.")
+    parser.add_argument("--jobs", required=True, help="JSON lines file with one job per line")
+    parser.add_argument("--report", help="write each job's timings here as JSON lines")
+    options = parser.parse_args(arguments)
+
+    jobs = read_jobs(options.jobs)
+    scene = batch_scene()
+    start_time = time.perf_counter()
+    reports = []
+    for number, job in enumerate(jobs, 1):
+        report = run_job(scene, number, job)
+        reports.append(report)
+        if "error" in report:
+            print ("%-20s FAILED after %.3f s: %s" % (report["name"], report["seconds"], report["error"]))
+        else:
+            print ("%-20s height %2d: %.3f s (reset %.3f s, build %.3f s, save/render %.3f s)"
+                   % (report["name"], report["height"], report["seconds"], report["reset_seconds"],
+                      report["build_seconds"], report["output_seconds"]))
+
+    seconds = time.perf_counter() - start_time
+    print ("Ran " + str(len(jobs)) + " jobs in " + str(seconds) + " seconds ("
+           + str(len(jobs) / seconds if seconds else 0) + " jobs/s).")
+
+    if options.report:
+        with open(options.report, "w") as report_file:
+            for report in reports:
+                report_file.write(json.dumps(report) + "\n")
+
+    failed = [report for report in reports if "error" in report]
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
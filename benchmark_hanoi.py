@@ -0,0 +1,288 @@
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+import types
+
+# This script times tower_of_hanoi.py without Blender.
+#
+# tower_of_hanoi.py needs bpy as soon as it touches the scene, so before importing it we
+# put a small fake "bpy" module into sys.modules for it to find.  The fake one
+# has just enough in it for the script to run (objects with a location, keyframe_insert(),
+# F-curves with keyframe_points, bpy.ops.object.text_add() and so on), and it doesn't keep
+# the keyframes, it only counts them.
+#
+# For each way of building the animation and each height it reports:
+#   moves/sec, keyframes/sec, wall time in seconds, and peak memory in bytes
+#   (peak memory comes from a second run with tracemalloc on, since tracemalloc slows
+#   everything down too much to time with it on).
+#
+# The ways of building the animation ("backends") are:
+#   moves:   just walking hanoi_moves(), no Blender work at all.
+#   per_move: hanoi.move_tower(), which calls keyframe_insert() over and over.
+#   dense:   hanoi.move_tower_bulk(), keyframing every disc on every step.
+#   sparse:  hanoi.move_tower_bulk(sparse=True), only keyframing the moving disc.
+#
+# The per_move and dense backends grow with height * 2^height, so by default they stop
+# at a lower height than the others (see --max-height below).
+#
+# Examples:
+#   python benchmark_hanoi.py
+#   python benchmark_hanoi.py --heights 3-12 --json results.jsonl
+#   python benchmark_hanoi.py --json new.jsonl --baseline old.jsonl
+
+# BEGIN: The fake bpy module.
+
+class fake_location:
+    def __init__(self):
+        self.x = 0.0
+        self.y = 0.0
+        self.z = 0.0
+
+# keyframe_insert() on "location" keys x, y and z at once, so we only count the keyframes
+# added to the x F-curve, to count the same way for both.
+class fake_keyframe_points:
+    def __init__(self, counts, counted):
+        self.counts = counts
+        self.counted = counted
+        self.size = 0
+
+    def add(self, count):
+        self.size += count
+        if self.counted:
+            self.counts["keyframes"] += count
+
+    def foreach_set(self, attribute, values):
+        if len(values) != 2 * self.size:
+            raise ValueError("foreach_set got " + str(len(values)) + " values for " + str(self.size) + " keyframes")
+        self.counts["foreach_set"] += 1
+
+class fake_fcurve:
+    def __init__(self, data_path, index, counts):
+        self.data_path = data_path
+        self.array_index = index
+        self.keyframe_points = fake_keyframe_points(counts, index == 0)
+
+    def update(self):
+        pass
+
+class fake_fcurves(list):
+    def __init__(self, counts):
+        list.__init__(self)
+        self.counts = counts
+
+    def find(self, data_path, index=0):
+        for fcurve in self:
+            if fcurve.data_path == data_path and fcurve.array_index == index:
+                return fcurve
+        return None
+
+    def new(self, data_path, index=0, action_group=""):
+        fcurve = fake_fcurve(data_path, index, self.counts)
+        self.append(fcurve)
+        return fcurve
+
+class fake_action:
+    def __init__(self, name, counts):
+        self.name = name
+        self.fcurves = fake_fcurves(counts)
+
+class fake_animation_data:
+    def __init__(self):
+        self.action = None
+
+class fake_object:
+    def __init__(self, name, counts):
+        self.name = name
+        self.counts = counts
+        self.location = fake_location()
+        self.animation_data = None
+        self.data = types.SimpleNamespace(name=name, body="")
+
+    def keyframe_insert(self, data_path, frame):
+        self.counts["keyframes"] += 1
+        self.counts["keyframe_insert"] += 1
+
+    def animation_data_create(self):
+        self.animation_data = fake_animation_data()
+        return self.animation_data
+
+class fake_objects(dict):
+    def __init__(self, counts):
+        dict.__init__(self)
+        self.counts = counts
+
+    def __missing__(self, name):
+        new_object = fake_object(name, self.counts)
+        self[name] = new_object
+        return new_object
+
+class fake_scene:
+    def __init__(self):
+        self.frame_start = 0
+        self.frame_end = 0
+        self.frame_current = 0
+        self.render = types.SimpleNamespace(filepath="")
+
+    def frame_set(self, frame):
+        self.frame_current = frame
+
+# Builds a new fake bpy module.  counts is shared by everything in it, so we can see how
+# many keyframes got made and how many calls went into Blender.
+def make_fake_bpy():
+    bpy = types.ModuleType("bpy")
+    bpy.counts = {"keyframes": 0, "keyframe_insert": 0, "foreach_set": 0}
+    bpy.data = types.SimpleNamespace()
+    bpy.context = types.SimpleNamespace(object=None, scene=fake_scene())
+
+    def text_add(location=(0, 0, 0), rotation=(0, 0, 0)):
+        bpy.context.object = bpy.data.objects["Text"]
+
+    def new_action(name):
+        return fake_action(name, bpy.counts)
+
+    def reset():
+        bpy.data.objects = fake_objects(bpy.counts)
+        bpy.data.actions = types.SimpleNamespace(new=new_action)
+        for key in bpy.counts:
+            bpy.counts[key] = 0
+
+    bpy.ops = types.SimpleNamespace(object=types.SimpleNamespace(text_add=text_add),
+                                    render=types.SimpleNamespace(render=lambda animation=False: None))
+    bpy.reset = reset
+    reset()
+    return bpy
+
+# END: The fake bpy module.
+
+fake_bpy = make_fake_bpy()
+sys.modules["bpy"] = fake_bpy
+
+import tower_of_hanoi
+
+backends = ("moves", "per_move", "dense", "sparse")
+
+# The default highest height for each backend, so a default run finishes in minutes.
+max_height = {"moves": 22, "per_move": 16, "dense": 18, "sparse": 22}
+
+# Runs one backend at one height and returns (moves, keyframes, seconds).
+def run_backend(backend, height):
+    fake_bpy.reset()
+    moves = (1 << height) - 1
+
+    if backend == "moves":
+        start_time = time.perf_counter()
+        for move in tower_of_hanoi.hanoi_moves(height, "tower_a", "tower_b", "tower_c"):
+            pass
+        return (moves, 0, time.perf_counter() - start_time)
+
+    # Stack the discs up on tower_a like they are in the .blend file.
+    for disc in range(1, height + 1):
+        fake_bpy.data.objects[tower_of_hanoi.disc_name(disc)].location.z = 0.5 * (height - disc)
+
+    start_time = time.perf_counter()
+    hanoi_object = tower_of_hanoi.hanoi(height)
+    if backend == "per_move":
+        hanoi_object.move_tower(height, "tower_a", "tower_b", "tower_c")
+    else:
+        hanoi_object.move_tower_bulk(height, "tower_a", "tower_b", "tower_c", sparse=(backend == "sparse"))
+    seconds = time.perf_counter() - start_time
+
+    return (moves, fake_bpy.counts["keyframes"], seconds)
+
+def measure(backend, height, memory):
+    gc.collect()
+    moves, keyframes, seconds = run_backend(backend, height)
+    result = {"backend": backend, "height": height, "moves": moves, "keyframes": keyframes,
+              "seconds": seconds,
+              "moves_per_second": moves / seconds if seconds else None,
+              "keyframes_per_second": keyframes / seconds if seconds else None,
+              "peak_memory_bytes": None}
+
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        run_backend(backend, height)
+        result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    fake_bpy.reset()
+    return result
+
+# "3-22" -> [3, 4, ..., 22], "3,5,8" -> [3, 5, 8]
+def parse_heights(text):
+    heights = []
+    for part in text.split(","):
+        if "-" in part:
+            low, high = part.split("-")
+            heights.extend(range(int(low), int(high) + 1))
+        else:
+            heights.append(int(part))
+    return heights
+
+# Compares moves_per_second against an earlier run's JSON lines, and returns a line of
+# text for every (backend, height) that got slower by more than "tolerance" (0.2 = 20%).
+def find_regressions(results, baseline_path, tolerance):
+    baseline = {}
+    with open(baseline_path) as baseline_file:
+        for line in baseline_file:
+            if line.strip():
+                old = json.loads(line)
+                baseline[(old["backend"], old["height"])] = old
+
+    regressions = []
+    for result in results:
+        old = baseline.get((result["backend"], result["height"]))
+        if old is None or not old["moves_per_second"] or not result["moves_per_second"]:
+            continue
+        change = result["moves_per_second"] / old["moves_per_second"] - 1
+        if change < -tolerance:
+            regressions.append(result["backend"] + " height " + str(result["height"]) + ": "
+                               + str(round(-change * 100, 1)) + "% slower")
+    return regressions
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description="Benchmark tower_of_hanoi.py with a fake bpy.")
+    parser.add_argument("--heights", default="3-22", help="e.g. 3-22 or 3,5,8 (default 3-22)")
+    parser.add_argument("--backends", default=",".join(backends),
+                        help="comma separated, from: " + ", ".join(backends))
+    parser.add_argument("--max-height", type=int, default=None,
+                        help="run every backend up to this height, instead of the default per backend limits")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--json", help="write results as JSON lines to this file (- for stdout)")
+    parser.add_argument("--baseline", help="JSON lines from an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    options = parser.parse_args(arguments)
+
+    results = []
+    for backend in options.backends.split(","):
+        limit = options.max_height if options.max_height is not None else max_height[backend]
+        for height in parse_heights(options.heights):
+            if height > limit:
+                continue
+            result = measure(backend, height, not options.no_memory)
+            results.append(result)
+            print ("%-8s height %2d: %10.0f moves/s %12.0f keyframes/s %9.3f s %12s bytes peak"
+                   % (backend, height, result["moves_per_second"] or 0, result["keyframes_per_second"] or 0,
+                      result["seconds"], result["peak_memory_bytes"]), file=sys.stderr)
+
+    if options.json:
+        lines = "".join(json.dumps(result) + "\n" for result in results)
+        if options.json == "-":
+            sys.stdout.write(lines)
+        else:
+            with open(options.json, "w") as json_file:
+                json_file.write(lines)
+
+    if options.baseline:
+        regressions = find_regressions(results, options.baseline, options.tolerance)
+        for regression in regressions:
+            print ("REGRESSION: " + regression, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import sys
+import time
+from array import array
+
+import tower_of_hanoi
+
+# This script writes the Tower of Hanoi animation out to files, so it can be played back
+# without Blender (in our web viewer, for example), as:
+#   JSON lines: one line of settings, then one line per move with the disc, the towers and
+#               its keyframes, as [frame, x, y, z].
+#   glTF:       a .gltf file with one node per disc and one animation moving them, and a .bin
+#               file next to it with all of the keyframes.
+#
+# The keyframes are the sparse ones (see plan_sparse_keyframes() in tower_of_hanoi.py), and
+# they come one move at a time from sparse_keyframe_moves(), so nothing ever holds on to more
+# than one move.  The JSON lines just get written as they come.  glTF wants all of the
+# keyframes for each disc together in the .bin file, but we know how many each disc gets
+# (sparse_key_count()), so we can work out where each disc's keyframes go up front and write
+# them there as we go, a few thousand at a time.  Either way the memory used stays the same
+# no matter how big the height is.
+#
+# Examples:
+#   python export_hanoi.py --height 20 --json-lines toh.jsonl --gltf toh.gltf
+#   python export_hanoi.py --height 6 --json-lines toh.jsonl --gltf toh.gltf --check
+
+# The discs start stacked up on tower_a at x = 0, y = 0, with the largest disc at z = 0,
+# unless we are told otherwise.
+def default_start_locations(height, geometry):
+    return {tower_of_hanoi.disc_name(disc): (0.0, 0.0, geometry.slot_z[height - disc])
+            for disc in range(1, height + 1)}
+
+def write_json_lines(output_file, height, frame_rate, start_locations, geometry=None):
+    output_file.write(json.dumps({"height": height, "frame_rate": frame_rate, "start_locations": start_locations})
+                      + "\n")
+    for move_number, disc, source_pole, destination_pole, keys in tower_of_hanoi.sparse_keyframe_moves(
+            height, frame_rate, start_locations, "tower_a", "tower_b", "tower_c", geometry=geometry):
+        y = start_locations[tower_of_hanoi.disc_name(disc)][1]
+        output_file.write(json.dumps({"move": move_number, "disc": disc, "from": source_pole, "to": destination_pole,
+                                      "keys": [[frame, x, y, z] for frame, x, z in keys]}) + "\n")
+
+# Reads a file from write_json_lines() back in as disc_tracks, for checking it.
+def read_json_lines(input_file):
+    settings = json.loads(input_file.readline())
+    tracks = {}
+    for name, (x, y, z) in settings["start_locations"].items():
+        tracks[name] = tower_of_hanoi.disc_track(name, y)
+        tracks[name].add(0, x, z)
+    for line in input_file:
+        move = json.loads(line)
+        track = tracks[tower_of_hanoi.disc_name(move["disc"])]
+        for frame, x, y, z in move["keys"]:
+            track.add(frame, x, z)
+    return [tracks[tower_of_hanoi.disc_name(disc)] for disc in range(1, settings["height"] + 1)]
+
+# One disc's part of the glTF .bin file: its keyframe times, then its keyframe values.
+# Keyframes are kept in "times" and "values" until there are flush_at of them, and then
+# written out where they belong in the file.
+#
+# The animation uses glTF's CUBICSPLINE interpolation, so each value is 3 vectors: the
+# tangent coming in, the location and the tangent going out.  The tangents are all 0, so
+# the discs stop on every keyframe like they do in Blender, but in between they follow
+# glTF's cubic (smoothstep) curve, not Blender's bezier easing, so only the keyframes
+# themselves are the same as in Blender.
+#
+# glTF has y pointing up, where Blender has z up, so (x, y, z) becomes (x, z, -y), the same as
+# Blender's own glTF exporter does.
+class gltf_disc_channel:
+    flush_at = 4096
+
+    def __init__(self, output_file, disc, count, times_offset, values_offset):
+        self.output_file = output_file
+        self.disc = disc
+        self.count = count
+        self.written = 0
+        self.times_offset = times_offset
+        self.values_offset = values_offset
+        self.times = array('f')
+        self.values = array('f')
+        self.last_time = 0.0
+
+    def add(self, seconds, x, y, z):
+        self.times.append(seconds)
+        self.values.extend((0.0, 0.0, 0.0, x, z, -y, 0.0, 0.0, 0.0))
+        self.last_time = seconds
+        if len(self.times) >= self.flush_at:
+            self.flush()
+
+    def flush(self):
+        self.output_file.seek(self.times_offset + 4 * self.written)
+        self.output_file.write(self.times.tobytes())
+        self.output_file.seek(self.values_offset + 36 * self.written)
+        self.output_file.write(self.values.tobytes())
+        self.written += len(self.times)
+        del self.times[:]
+        del self.values[:]
+
+def write_gltf(gltf_path, height, frame_rate, start_locations, frames_per_second=24, geometry=None):
+    bin_path = os.path.splitext(gltf_path)[0] + ".bin"
+
+    # Work out where every disc's keyframes go in the .bin file.
+    channels = []
+    offset = 0
+    with open(bin_path, "wb") as bin_file:
+        for disc in range(1, height + 1):
+            count = tower_of_hanoi.sparse_key_count(height, disc)
+            channels.append(gltf_disc_channel(bin_file, disc, count, offset, offset + 4 * count))
+            offset += 40 * count
+        bin_file.truncate(offset)
+
+        for channel in channels:
+            x, y, z = start_locations[tower_of_hanoi.disc_name(channel.disc)]
+            channel.add(0.0, x, y, z)
+        for move_number, disc, source_pole, destination_pole, keys in tower_of_hanoi.sparse_keyframe_moves(
+                height, frame_rate, start_locations, "tower_a", "tower_b", "tower_c", geometry=geometry):
+            channel = channels[disc - 1]
+            y = start_locations[tower_of_hanoi.disc_name(disc)][1]
+            for frame, x, z in keys:
+                channel.add(frame / frames_per_second, x, y, z)
+        for channel in channels:
+            channel.flush()
+            if channel.written != channel.count:
+                raise ValueError(tower_of_hanoi.disc_name(channel.disc) + " got " + str(channel.written)
+                                 + " keyframes instead of " + str(channel.count))
+
+    # Now the .gltf file itself, which only has a few entries per disc in it.
+    gltf = {"asset": {"version": "2.0", "generator": "export_hanoi.py"},
+            "scene": 0, "scenes": [{"nodes": list(range(height))}],
+            "nodes": [], "buffers": [{"uri": os.path.basename(bin_path), "byteLength": offset}],
+            "bufferViews": [], "accessors": [], "animations": [{"name": "tower_of_hanoi", "channels": [], "samplers": []}]}
+    animation = gltf["animations"][0]
+    for channel in channels:
+        x, y, z = start_locations[tower_of_hanoi.disc_name(channel.disc)]
+        gltf["nodes"].append({"name": tower_of_hanoi.disc_name(channel.disc), "translation": [x, z, -y]})
+
+        times = len(gltf["accessors"])
+        gltf["bufferViews"].append({"buffer": 0, "byteOffset": channel.times_offset, "byteLength": 4 * channel.count})
+        gltf["accessors"].append({"bufferView": len(gltf["bufferViews"]) - 1, "componentType": 5126,
+                                  "count": channel.count, "type": "SCALAR", "min": [0.0], "max": [channel.last_time]})
+        gltf["bufferViews"].append({"buffer": 0, "byteOffset": channel.values_offset, "byteLength": 36 * channel.count})
+        gltf["accessors"].append({"bufferView": len(gltf["bufferViews"]) - 1, "componentType": 5126,
+                                  "count": 3 * channel.count, "type": "VEC3"})
+
+        animation["samplers"].append({"input": times, "output": times + 1, "interpolation": "CUBICSPLINE"})
+        animation["channels"].append({"sampler": len(animation["samplers"]) - 1,
+                                      "target": {"node": channel.disc - 1, "path": "translation"}})
+
+    with open(gltf_path, "w") as gltf_file:
+        json.dump(gltf, gltf_file, indent=1)
+
+# Reads the keyframes back out of a file from write_gltf() as disc_tracks (in Blender's
+# frames and axes), for checking it.
+def read_gltf(gltf_path, frames_per_second=24):
+    with open(gltf_path) as gltf_file:
+        gltf = json.load(gltf_file)
+    with open(os.path.join(os.path.dirname(gltf_path), gltf["buffers"][0]["uri"]), "rb") as bin_file:
+        data = bin_file.read()
+
+    tracks = []
+    for sampler, node in zip(gltf["animations"][0]["samplers"], gltf["nodes"]):
+        views = []
+        for accessor in (gltf["accessors"][sampler["input"]], gltf["accessors"][sampler["output"]]):
+            view = gltf["bufferViews"][accessor["bufferView"]]
+            views.append(array('f', data[view["byteOffset"]:view["byteOffset"] + view["byteLength"]]))
+        times, values = views
+
+        track = tower_of_hanoi.disc_track(node["name"], -node["translation"][2])
+        for key in range(len(times)):
+            x, up, minus_y = values[9 * key + 3:9 * key + 6]
+            track.add(times[key] * frames_per_second, x, up)
+        tracks.append(track)
+    return tracks
+
+# Checks the keyframes in both files against the keyframes move_disk() puts in, which
+# plan_dense_keyframes() works out without Blender: every disc has to be in the same place on
+# every one of those frames.  It doesn't look at how either one moves between keyframes.
+# Returns None if they match, otherwise (file, disc name, frame, expected, got).
+def check_files(json_lines_path, gltf_path, height, frame_rate, start_locations, frames_per_second=24):
+    dense = tower_of_hanoi.plan_dense_keyframes(height, frame_rate, start_locations, "tower_a", "tower_b", "tower_c")
+    if json_lines_path:
+        with open(json_lines_path) as json_lines_file:
+            problem = tower_of_hanoi.check_sparse_keyframes(dense, read_json_lines(json_lines_file))
+        if problem is not None:
+            return (json_lines_path,) + problem
+    if gltf_path:
+        problem = tower_of_hanoi.check_sparse_keyframes(dense, read_gltf(gltf_path, frames_per_second))
+        if problem is not None:
+            return (gltf_path,) + problem
+    return None
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description="Export the Tower of Hanoi animation as JSON lines and glTF.")
+    parser.add_argument("--height", type=int, default=3)
+    parser.add_argument("--frame-rate", type=int, default=24, help="frames per step of each move (default 24)")
+    parser.add_argument("--fps", type=int, default=24, help="frames per second, for the glTF times (default 24)")
+    parser.add_argument("--json-lines", help="write the moves and keyframes as JSON lines to this file")
+    parser.add_argument("--gltf", help="write a .gltf file here, with its .bin file next to it")
+    parser.add_argument("--check", action="store_true",
+                        help="check the files' keyframes against the ones move_disk() makes (slow, for small heights)")
+    options = parser.parse_args(arguments)
+    if not options.json_lines and not options.gltf:
+        parser.error("nothing to do, give --json-lines and/or --gltf")
+
+    geometry = tower_of_hanoi.tower_geometry(options.height)
+    start_locations = default_start_locations(options.height, geometry)
+
+    start_time = time.perf_counter()
+    if options.json_lines:
+        with open(options.json_lines, "w") as json_lines_file:
+            write_json_lines(json_lines_file, options.height, options.frame_rate, start_locations, geometry)
+    if options.gltf:
+        write_gltf(options.gltf, options.height, options.frame_rate, start_locations, options.fps, geometry)
+    print ("Exported " + str((1 << options.height) - 1) + " moves in " + str(time.perf_counter() - start_time)
+           + " seconds.")
+
+    if options.check:
+        problem = check_files(options.json_lines, options.gltf, options.height, options.frame_rate,
+                              start_locations, options.fps)
+        if problem is not None:
+            print ("MISMATCH: " + repr(problem), file=sys.stderr)
+            return 1
+        print ("The keyframes in the files match the move_disk() keyframes.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,161 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# This script renders the Tower of Hanoi animation in chunks, in parallel.
+#
+# Rendering the whole timeline in one Blender process only uses one core for everything
+# that isn't the renderer itself, and the timeline gets long fast (3 * frame_rate frames
+# per move, and 2^height - 1 moves).  So instead we:
+#   1.  Work out how many frames there are from the height and frame rate.
+#   2.  Split the frames into chunks.
+#   3.  Start one "blender --background" per chunk from a pool of worker processes.
+#       Each one loads tower_of_hanoi.blend, keys only the moves its chunk needs
+#       (see render_chunk() in tower_of_hanoi.py) and renders just those frames.  The
+#       .blend file has to be set to render a movie, so each chunk is one file.
+#   4.  Join the rendered segments back together in order with ffmpeg.
+#
+# Run it outside of Blender, like this:
+#   python render_chunks.py --height 3 --output toh.avi
+#
+# For trying it out without Blender, --stub runs render_chunk() in each worker against the
+# fake bpy module from benchmark_hanoi.py, with a fake renderer that just writes out the
+# frame numbers it was asked to render (and burns a bit of CPU per frame with --stub-work,
+# so you can see how it scales), and joins the segments by appending them.
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# Each move is 3 steps (up, across, down) of frame_rate frames, and the animation starts on
+# frame 0, so the last frame is 3 * frame_rate * (2^height - 1).
+def last_frame(height, frame_rate):
+    return 3 * frame_rate * ((1 << height) - 1)
+
+# Splits frames 0 .. frame_end (both included, like Blender's frame range) into "chunks"
+# ranges that are as close to the same size as possible.
+def split_frames(frame_end, chunks):
+    total = frame_end + 1
+    chunks = max(1, min(chunks, total))
+    ranges = []
+    start = 0
+    for chunk in range(chunks):
+        size = total // chunks + (1 if chunk < total % chunks else 0)
+        ranges.append((start, start + size - 1))
+        start += size
+    return ranges
+
+# Blender adds the frame range and the file extension onto the output path itself,
+# so we give every chunk its own folder and pick up whatever files it wrote in there,
+# in order.
+def render_with_blender(job):
+    blender, blend_file, height, frame_rate, frame_start, frame_end, chunk_folder = job
+    command = [blender, "--background", blend_file,
+               "--python", os.path.join(here, "tower_of_hanoi.py"), "--",
+               "--height", str(height),
+               "--frame-rate", str(frame_rate),
+               "--frame-start", str(frame_start),
+               "--frame-end", str(frame_end),
+               "--output", os.path.join(chunk_folder, "segment_")]
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+    return chunk_files(chunk_folder)
+
+def chunk_files(chunk_folder):
+    return [os.path.join(chunk_folder, name) for name in sorted(os.listdir(chunk_folder))]
+
+def render_with_stub(job):
+    work, height, frame_rate, frame_start, frame_end, chunk_folder = job
+
+    # Importing benchmark_hanoi puts its fake bpy into sys.modules, so tower_of_hanoi
+    # uses that instead of Blender.  Each worker process imports it once.
+    import benchmark_hanoi
+    import tower_of_hanoi
+
+    fake_bpy = benchmark_hanoi.fake_bpy
+    fake_bpy.reset()
+    scene = fake_bpy.context.scene
+    scene.render.is_movie_format = True
+
+    # Stack the discs up on tower_a like they are in the .blend file.
+    for disc in range(1, height + 1):
+        fake_bpy.data.objects[tower_of_hanoi.disc_name(disc)].location.z = 0.5 * (height - disc)
+
+    def render(animation=False):
+        segment = scene.render.filepath + "%04d-%04d.txt" % (scene.frame_start, scene.frame_end)
+        with open(segment, "w") as segment_file:
+            for frame in range(scene.frame_start, scene.frame_end + 1):
+                total = 0
+                for step in range(work):
+                    total += step * frame
+                segment_file.write("frame " + str(frame) + "\n")
+
+    fake_bpy.ops.render.render = render
+    tower_of_hanoi.render_chunk(height, frame_rate, frame_start, frame_end, os.path.join(chunk_folder, "segment_"))
+    return chunk_files(chunk_folder)
+
+def join_with_ffmpeg(segments, output_path):
+    list_path = output_path + ".segments.txt"
+    with open(list_path, "w") as list_file:
+        for segment in segments:
+            list_file.write("file '" + os.path.abspath(segment) + "'\n")
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0",
+                    "-i", list_path, "-c", "copy", output_path], check=True)
+    os.remove(list_path)
+
+def join_by_appending(segments, output_path):
+    with open(output_path, "wb") as output_file:
+        for segment in segments:
+            with open(segment, "rb") as segment_file:
+                shutil.copyfileobj(segment_file, output_file)
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description="Render the Tower of Hanoi animation in parallel chunks.")
+    parser.add_argument("--height", type=int, default=3)
+    parser.add_argument("--frame-rate", type=int, default=24)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunks", type=int, default=None,
+                        help="how many pieces to split the frames into (default: same as --workers)")
+    parser.add_argument("--blender", default="blender")
+    parser.add_argument("--blend-file", default=os.path.join(here, "tower_of_hanoi.blend"))
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--stub", action="store_true", help="use a fake renderer instead of Blender")
+    parser.add_argument("--stub-work", type=int, default=0, help="busy work per frame for --stub")
+    options = parser.parse_args(arguments)
+
+    chunks = options.chunks or options.workers
+    frame_ranges = split_frames(last_frame(options.height, options.frame_rate), chunks)
+
+    start_time = time.perf_counter()
+    work_folder = tempfile.mkdtemp(prefix="toh_chunks_")
+    try:
+        jobs = []
+        for number, (frame_start, frame_end) in enumerate(frame_ranges):
+            chunk_folder = os.path.join(work_folder, "chunk_%04d" % number)
+            os.mkdir(chunk_folder)
+            if options.stub:
+                jobs.append((options.stub_work, options.height, options.frame_rate, frame_start, frame_end, chunk_folder))
+            else:
+                jobs.append((options.blender, options.blend_file, options.height, options.frame_rate,
+                             frame_start, frame_end, chunk_folder))
+
+        renderer = render_with_stub if options.stub else render_with_blender
+        with ProcessPoolExecutor(max_workers=options.workers) as pool:
+            # map() hands the results back in the same order as the jobs, which is the
+            # order the segments need to be joined in.
+            segments = [segment for chunk in pool.map(renderer, jobs) for segment in chunk]
+
+        if options.stub:
+            join_by_appending(segments, options.output)
+        else:
+            join_with_ffmpeg(segments, options.output)
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    print ("Rendered frames 0-" + str(frame_ranges[-1][1]) + " in " + str(len(frame_ranges)) + " chunks on "
+           + str(options.workers) + " workers in " + str(time.perf_counter() - start_time) + " seconds.")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
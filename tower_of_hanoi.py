@@ -1,6 +1,10 @@
-import bpy
 import time
 import sys
+import os
+import mmap
+import struct
+import hashlib
+from array import array
 
 # This script moves the disks in our Tower of Hanoi animation.
 # The basic setup is this:
@@ -15,6 +19,18 @@ import sys
 
 # --Shaun Miller 05/16/2015
 
+# bpy is Blender's Python module, so it only exists when we are running inside of Blender.
+# Everything that works out the moves and keyframes doesn't need it, so we don't import it
+# until something actually has to talk to Blender (the hanoi class, write_keyframes_bulk()
+# and render_chunk() all call import_bpy() first).  That way other scripts, like
+# benchmark_hanoi.py, can import this file quickly and without Blender.
+bpy = None
+
+def import_bpy():
+    global bpy
+    import bpy
+    return bpy
+
 # The first thing we have here is that we define a Stack data structure.
 # The reason for this is that the Tower of Hanoi towers are just that, Stacks.
 # They have a First in, Last out mechanism.  
@@ -23,6 +39,10 @@ import sys
 # them on to another one.  By pushing and popping the discs on/off of a Stack at the 
 # same time that we move the discs in Blender, we are able to keep track of where they 
 # are and move the dics the appropriate amount of Blender units. 
+#
+# The hanoi class now uses tower_state below instead, which does the same job for all
+# 3 towers at once with a lot less memory and work per move.  This Stack is kept around
+# so benchmark_tower_state() has something to compare against.
 
 class stack_with_hole_on_right:
     def __init__(self):
@@ -46,6 +66,1684 @@ class stack_with_hole_on_right:
     def print_all(self):
         print (self.items)
 
+# tower_state keeps track of which discs are on which of the towers (3 unless we say
+# otherwise), using integer disc numbers (1 is the smallest) and tower numbers (0, 1, 2, ...)
+# instead of names.
+#
+# Each tower is a single integer used as a set of bits: bit 0 is set if disc 1 is on it,
+# bit 1 if disc 2 is on it, and so on.  Since smaller discs always sit on top of bigger
+# ones, the top disc of a tower is just its lowest set bit, which we can get with
+# board & -board.  The height of a tower is how many bits are set, but counting them
+# quickly needs int.bit_count(), which is Python 3.10 (Blender 3.1) and our .blend file
+# comes from Blender 2.72, so we keep a count of the discs on each tower in "heights"
+# as they move instead.  So push, pop, top and height never have to look through the
+# discs, and the whole state is two small integers per tower, even for 25 or more discs.
+#
+# __slots__ stops Python from giving every object its own dictionary, which keeps it
+# small and makes looking up the attribute a bit quicker.
+class tower_state:
+    __slots__ = ("boards", "heights")
+
+    # Start with discs 1 .. discs stacked up on tower number "tower", out of "towers" towers.
+    def __init__(self, discs, tower=0, towers=3):
+        self.boards = [0] * towers
+        self.boards[tower] = (1 << discs) - 1
+        self.heights = [0] * towers
+        self.heights[tower] = discs
+
+    def is_empty(self, tower):
+        return self.boards[tower] == 0
+
+    def push(self, tower, disc):
+        self.boards[tower] |= 1 << (disc - 1)
+        self.heights[tower] += 1
+
+    def pop(self, tower):
+        board = self.boards[tower]
+        bit = board & -board
+        self.boards[tower] = board ^ bit
+        self.heights[tower] -= 1
+        return bit.bit_length()
+
+    # Returns 0 if the tower is empty.
+    def top(self, tower):
+        board = self.boards[tower]
+        return (board & -board).bit_length()
+
+    def height(self, tower):
+        return self.heights[tower]
+
+    # The tower number that disc number "disc" is on, or None if it isn't on any of them.
+    def tower_of(self, disc):
+        bit = 1 << (disc - 1)
+        for tower in range(len(self.boards)):
+            if self.boards[tower] & bit:
+                return tower
+        return None
+
+    # Takes the top disc off of one tower and puts it on another in one go, and returns
+    # which disc it was.  This is what the animation does once per move, so it's worth
+    # not going through pop() and push() separately.
+    def move(self, from_tower, to_tower):
+        boards = self.boards
+        board = boards[from_tower]
+        bit = board & -board
+        boards[from_tower] = board ^ bit
+        boards[to_tower] |= bit
+        heights = self.heights
+        heights[from_tower] -= 1
+        heights[to_tower] += 1
+        return bit.bit_length()
+
+    # Moves the top "count" discs from one tower to another, keeping their order.
+    # This is only safe when those discs are discs 1 .. count, which is always the case
+    # when moving a whole tower of that height.
+    def move_top(self, from_tower, to_tower, count):
+        mask = (1 << count) - 1
+        self.boards[to_tower] |= self.boards[from_tower] & mask
+        self.boards[from_tower] &= ~mask
+        self.heights[from_tower] -= count
+        self.heights[to_tower] += count
+
+# This times moving every disc of a height "height" puzzle with tower_state against doing
+# the same with 3 stack_with_hole_on_right stacks, the way hanoi used to.  For each move
+# we look up the same things move_disk() needs (both tower heights and the disc that is
+# moving).  The moves are worked out first so we are only timing the towers, and it
+# prints nanoseconds per move.
+def benchmark_tower_state(height=20):
+    moves = [(source, destination) for disc, source, destination in hanoi_moves(height, 0, 1, 2)]
+
+    stacks = [stack_with_hole_on_right(), stack_with_hole_on_right(), stack_with_hole_on_right()]
+    for disc in range(height, 0, -1):
+        stacks[0].push(disc_name(disc))
+    start_time = time.perf_counter()
+    for source, destination in moves:
+        stacks[source].size()
+        stacks[source].peek()
+        stacks[destination].size()
+        stacks[destination].push(stacks[source].pop())
+    stack_seconds = time.perf_counter() - start_time
+
+    towers = tower_state(height)
+    start_time = time.perf_counter()
+    for source, destination in moves:
+        towers.height(source)
+        towers.height(destination)
+        towers.move(source, destination)
+    tower_state_seconds = time.perf_counter() - start_time
+
+    print ("stack_with_hole_on_right: " + str(stack_seconds * 1e9 / len(moves)) + " ns per move")
+    print ("tower_state:              " + str(tower_state_seconds * 1e9 / len(moves)) + " ns per move")
+    return (stack_seconds, tower_state_seconds)
+
+# This is a non-recursive version of the Tower of Hanoi algorithm.
+# Instead of returning a big list, it yields one move at a time as a tuple of
+# (disc, from_pole, to_pole), where disc 1 is the smallest disc ("ring_size_1").
+#
+# It works off of the binary representation of the move number m (1 .. 2^height - 1):
+#   - The disc that moves is the number of trailing zero bits in m, plus 1.
+#   - The source peg is (m & (m - 1)) % 3 and the destination peg is ((m | (m - 1)) + 1) % 3.
+#
+# Those peg numbers send the tower from peg 0 to peg 2 for an odd height and from peg 0
+# to peg 1 for an even height, so we just swap which name peg 1 and peg 2 stand for.
+# Each move costs the same small amount of work and we only ever hold the current move
+# number, so this can stream millions of moves without building them up in memory and
+# without hitting Python's recursion limit.
+#
+# first_move lets us start part way through (move numbers start at 1), since any move can be
+# worked out on its own without knowing the ones before it.
+def hanoi_moves(height, from_pole, to_pole, with_pole, first_move=1):
+    if height % 2 == 1:
+        pole_names = (from_pole, with_pole, to_pole)
+    else:
+        pole_names = (from_pole, to_pole, with_pole)
+
+    for move_number in range(first_move, 1 << height):
+        disc = (move_number & -move_number).bit_length()
+        source = (move_number & (move_number - 1)) % 3
+        destination = ((move_number | (move_number - 1)) + 1) % 3
+        yield (disc, pole_names[source], pole_names[destination])
+
+# With more than 3 towers we use the Frame-Stewart algorithm.  To move n discs using k towers:
+#   1.  Move the top t discs to one of the spare towers, using all k towers.
+#   2.  Move the other n - t discs to the destination using the k - 1 towers that are left
+#       (the spare tower holding the t discs is out of bounds, since they are all smaller).
+#   3.  Move the t discs from the spare tower on to the destination, using all k towers again.
+# With 3 towers that is just the normal algorithm (t is always n - 1), so we use
+# hanoi_moves() for it.
+#
+# The hard part is picking t.  The fewest moves for n discs on k towers is
+#   moves(n, k) = the smallest 2 * moves(t, k) + moves(n - t, k - 1) for t in 1 .. n - 1
+# which we work out once and keep in frame_stewart_tables:  frame_stewart_tables[k][n] is
+# (moves(n, k), best t).  Each table is filled in from n = 0 up, so nothing recurses, and
+# since the best t never goes down as n goes up, each new row only has to carry on looking
+# from where the row before it found its best t.
+#
+# The tables are kept for later calls, but if they ever hold more than
+# frame_stewart_table_limit rows between them, we throw them away and start again, so they
+# can't grow without end.
+frame_stewart_tables = {}
+frame_stewart_table_limit = 1 << 16
+
+def frame_stewart_table(discs, pegs):
+    if pegs < 3:
+        raise ValueError("the Frame-Stewart algorithm needs at least 3 towers, not " + str(pegs))
+
+    table = frame_stewart_tables.get(pegs)
+    if table is not None and len(table) > discs:
+        return table
+
+    rows = sum(len(other_table) for other_table in frame_stewart_tables.values())
+    if rows + (discs + 1) * (pegs - 2) > frame_stewart_table_limit:
+        frame_stewart_tables.clear()
+
+    if pegs == 3:
+        table = frame_stewart_tables.setdefault(pegs, [(0, 0)])
+        while len(table) <= discs:
+            height = len(table)
+            table.append(((1 << height) - 1, height - 1))
+        return table
+
+    fewer = frame_stewart_table(discs, pegs - 1)
+    table = frame_stewart_tables.setdefault(pegs, [(0, 0)])
+    while len(table) <= discs:
+        height = len(table)
+        if height == 1:
+            table.append((1, 0))
+            continue
+        split = max(table[-1][1], 1)
+        best = 2 * table[split][0] + fewer[height - split][0]
+        while split + 1 < height:
+            moves = 2 * table[split + 1][0] + fewer[height - split - 1][0]
+            if moves > best:
+                break
+            split += 1
+            best = moves
+        table.append((best, split))
+    return table
+
+# How many moves it takes to move "discs" discs using "pegs" towers.
+def frame_stewart_move_count(discs, pegs):
+    return frame_stewart_table(discs, pegs)[discs][0]
+
+# This yields the Frame-Stewart moves one at a time as (disc, from_pole, to_pole), the same
+# as hanoi_moves(), so move_disk() can take them just the same.  spare_poles are the names of
+# all of the other towers (so with_pole from hanoi_moves() becomes a list of names).
+#
+# Instead of recursing, it keeps a list of the jobs it still has to do, each one being
+# "move these discs from here to there with these spare towers".  A job that only has one
+# spare tower is handed to hanoi_moves(), and disc numbers are shifted up by however many
+# smaller discs are sitting out of the way on another tower.
+def frame_stewart_moves(height, from_pole, to_pole, spare_poles):
+    spare_poles = tuple(spare_poles)
+    frame_stewart_table(height, len(spare_poles) + 2)
+
+    # Each job is (number of discs, number of smaller discs not in this job, from, to, spares).
+    jobs = [(height, 0, from_pole, to_pole, spare_poles)]
+    while jobs:
+        count, smaller, source_pole, destination_pole, spares = jobs.pop()
+        if count == 0:
+            continue
+        if count == 1 or len(spares) == 1:
+            for disc, source, destination in hanoi_moves(count, source_pole, destination_pole, spares[0]):
+                yield (disc + smaller, source, destination)
+            continue
+
+        split = frame_stewart_table(count, len(spares) + 2)[count][1]
+        middle_pole = spares[0]
+        # These come off of the end of the list, so they are added in reverse order.
+        jobs.append((split, smaller, middle_pole, destination_pole, (source_pole,) + spares[1:]))
+        jobs.append((count - split, smaller + split, source_pole, destination_pole, spares[1:]))
+        jobs.append((split, smaller, source_pole, middle_pole, (destination_pole,) + spares[1:]))
+
+# This solves the puzzle from any legal position, not just from a full tower.  disc_poles says
+# which tower each disc is on (disc_poles[0] is disc 1, the smallest), and every disc ends up
+# on to_pole.  Any list of towers is legal, since the discs on each tower are always stacked
+# up largest first.
+#
+# Going from the largest disc down to the smallest:
+#   - If the disc is already where it needs to be, we leave it there and the smaller discs need
+#     to end up in the same place.
+#   - Otherwise the smaller discs first all have to get out of the way on to the other tower,
+#     then the disc moves, then the smaller discs move on top of it as a normal tower.
+# So each disc has one place it has to end up (goal_poles below), and the moves are: for each
+# disc that has to move, smallest first, move it and then move the tower of discs smaller than
+# it on top of it with hanoi_moves().  That is the shortest solution, it takes one pass over
+# the discs to set up, and then every move comes straight out without any searching.
+#
+# poles are the names of the 3 towers; disc_poles and to_pole use the same names.
+def solve_moves(disc_poles, to_pole, poles=("tower_a", "tower_b", "tower_c")):
+    discs = len(disc_poles)
+    goal_poles = [None] * discs
+    goal = to_pole
+    for index in range(discs - 1, -1, -1):
+        goal_poles[index] = goal
+        if disc_poles[index] != goal:
+            goal = other_pole(poles, disc_poles[index], goal)
+
+    for index in range(discs):
+        pole = disc_poles[index]
+        goal = goal_poles[index]
+        if pole != goal:
+            spare_pole = other_pole(poles, pole, goal)
+            yield (index + 1, pole, goal)
+            yield from hanoi_moves(index, spare_pole, goal, pole)
+
+# The one tower out of the 3 in poles that is neither first_pole nor second_pole.
+def other_pole(poles, first_pole, second_pole):
+    for pole in poles:
+        if pole != first_pole and pole != second_pole:
+            return pole
+    raise ValueError("no tower left over from " + repr(poles) + " besides " + first_pole + " and " + second_pole)
+
+# How many moves solve_moves() makes, without going through them.  Disc number d only
+# moves when it isn't already on its goal tower, and then it and the discs above it take
+# 2^(d - 1) moves between them.
+def solve_move_count(disc_poles, to_pole, poles=("tower_a", "tower_b", "tower_c")):
+    count = 0
+    goal = to_pole
+    for index in range(len(disc_poles) - 1, -1, -1):
+        if disc_poles[index] != goal:
+            count += 1 << index
+            goal = other_pole(poles, disc_poles[index], goal)
+    return count
+
+# This checks solve_moves() the slow way, for small numbers of discs (up to about 12): it
+# searches every position the puzzle can be in, breadth first, for the shortest way to get
+# from disc_poles to everything on to_pole, and returns how many moves that is.
+#
+# A position is one integer with 2 bits per disc holding its tower number (disc 1 in the
+# lowest 2 bits), and the positions we have already seen are bits in a bytearray, so even
+# with 12 discs (3^12 = 531441 positions) this only needs 2 MB and no tuples or sets.
+def shortest_move_count(disc_poles, to_pole, poles=("tower_a", "tower_b", "tower_c")):
+    discs = len(disc_poles)
+    tower_numbers = {pole: number for number, pole in enumerate(poles)}
+
+    start = 0
+    for index in range(discs - 1, -1, -1):
+        start = (start << 2) | tower_numbers[disc_poles[index]]
+    goal = 0
+    for index in range(discs):
+        goal = (goal << 2) | tower_numbers[to_pole]
+
+    if start == goal:
+        return 0
+    seen = bytearray(((1 << (2 * discs)) + 7) // 8)
+    seen[start >> 3] |= 1 << (start & 7)
+    level = array('q', [start])
+    moves = 0
+    while level:
+        next_level = array('q')
+        for state in level:
+            # The top disc of each tower is the smallest disc on it.
+            tops = [-1, -1, -1]
+            found = 0
+            for index in range(discs):
+                tower = (state >> (2 * index)) & 3
+                if tops[tower] < 0:
+                    tops[tower] = index
+                    found += 1
+                    if found == 3:
+                        break
+
+            for source in range(3):
+                disc = tops[source]
+                if disc < 0:
+                    continue
+                for destination in range(3):
+                    if destination == source or (0 <= tops[destination] < disc):
+                        continue
+                    moved = state ^ ((source ^ destination) << (2 * disc))
+                    if not seen[moved >> 3] & (1 << (moved & 7)):
+                        seen[moved >> 3] |= 1 << (moved & 7)
+                        next_level.append(moved)
+        level = next_level
+        moves += 1
+        if seen[goal >> 3] & (1 << (goal & 7)):
+            return moves
+    return None
+
+# Plays the moves from solve_moves() on a tower_state, checking each one is legal and that
+# everything ends up on to_pole, and compares how many there were with
+# shortest_move_count().  Returns None if it all checks out, otherwise what went wrong.
+def check_solve_moves(disc_poles, to_pole, poles=("tower_a", "tower_b", "tower_c")):
+    tower_numbers = {pole: number for number, pole in enumerate(poles)}
+    towers = tower_state(0, 0, len(poles))
+    for index in range(len(disc_poles) - 1, -1, -1):
+        towers.push(tower_numbers[disc_poles[index]], index + 1)
+
+    count = 0
+    for disc, source_pole, destination_pole in solve_moves(disc_poles, to_pole, poles):
+        count += 1
+        source = tower_numbers[source_pole]
+        destination = tower_numbers[destination_pole]
+        if towers.top(source) != disc:
+            return "move " + str(count) + ": disc " + str(disc) + " isn't on top of " + source_pole
+        if 0 < towers.top(destination) < disc:
+            return "move " + str(count) + ": disc " + str(disc) + " goes on a smaller disc on " + destination_pole
+        towers.move(source, destination)
+
+    if towers.height(tower_numbers[to_pole]) != len(disc_poles):
+        return "not every disc ended up on " + to_pole
+    shortest = shortest_move_count(disc_poles, to_pole, poles)
+    if count != shortest:
+        return str(count) + " moves, but it can be done in " + str(shortest)
+    return None
+
+# The discs in our .blend file are named "ring_size_1" (smallest) up to "ring_size_3" (largest).
+def disc_name(disc):
+    return "ring_size_" + str(disc)
+
+# The tower numbers that tower_state uses for each of our tower names.  tower_d and tower_e
+# are only there for the 4 and 5 tower versions (see frame_stewart_moves() above).
+pole_numbers = {"tower_a": 0, "tower_b": 1, "tower_c": 2, "tower_d": 3, "tower_e": 4}
+
+# tower_geometry holds all of the measurements we need to move the discs around, in Blender units.
+#
+#   disc_thickness: how tall each disc is, so how far apart the slots on a tower are.
+#   peg_height:     how tall the pegs are above the bottom slot.
+#   clearance:      how far above the top of the peg (or the tallest possible stack of
+#                   discs, if that is higher) a disc is lifted before it moves across.
+#   pole_x:         where each tower (by tower number) sits on the x axis.
+#
+# From those we work out:
+#   lift:    how high above the bottom slot every disc gets lifted to.
+#   slot_z:  slot_z[n] is how high above the bottom slot a disc sits with n discs under it.
+#
+# The defaults match the 3 disc scene in our .blend file, where the discs are 0.5 units
+# thick, get lifted to 7 units above the bottom slot and the towers are 5 units apart.
+class tower_geometry:
+    def __init__(self, discs, disc_thickness=0.5, peg_height=5.5, clearance=1.5, pole_x=(0, 5, 10)):
+        self.discs = discs
+        self.disc_thickness = disc_thickness
+        self.peg_height = peg_height
+        self.clearance = clearance
+        self.pole_x = pole_x
+
+        self.lift = max(peg_height, discs * disc_thickness) + clearance
+        self.slot_z = [disc_thickness * slot for slot in range(discs + 1)]
+
+    # How far a disc moves along the x axis to get from one named tower to another.
+    def across(self, from_pole, to_pole):
+        return self.pole_x[pole_numbers[to_pole]] - self.pole_x[pole_numbers[from_pole]]
+
+# Everything below up to the hanoi class is for the "bulk" way of building the animation.
+#
+# Calling keyframe_insert() goes through Blender's operator layer every single time,
+# and move_disk() ends up calling it about 9 times per move.  Instead of that, we can
+# work out every keyframe up front into plain arrays (no bpy needed for that part),
+# then create each disc's location F-curves once and fill them in one shot with
+# keyframe_points.add() and foreach_set("co", ...).
+
+# A disc_track holds all of the keyframes for one disc: the frame numbers and the
+# x and z locations at those frames.  The y location never changes so we just keep one value.
+class disc_track:
+    def __init__(self, name, y):
+        self.name = name
+        self.y = y
+        self.frames = array('f')
+        self.x = array('f')
+        self.z = array('f')
+
+    def add(self, frame, x, z):
+        self.frames.append(frame)
+        self.x.append(x)
+        self.z.append(z)
+
+    def size(self):
+        return len(self.frames)
+
+    # foreach_set("co", ...) wants the points flattened as [frame, value, frame, value, ...].
+    # Going through a memoryview lets frames and values be either arrays or the memoryviews
+    # that plan_cache gives back.
+    def co(self, values):
+        flat = array('f', bytes(8 * len(self.frames)))
+        flat_view = memoryview(flat)
+        flat_view[0::2] = self.frames
+        flat_view[1::2] = values
+        return flat
+
+# This works out the same keyframes that move_tower()/move_disk() insert one at a time.
+#
+# move_disk() moves a disc in 3 steps of frame_rate frames (up, across, down), and after
+# every step it keys the disc that moved and then keep_other_discs_at_rest() keys all of
+# the others.  So every disc ends up with a keyframe on every step, and at each step we
+# just record where every disc currently is.
+#
+# start_locations maps each disc name to its (x, y, z) location at frame 0, which is
+# where the discs are sitting in the .blend file before we animate anything.
+#
+# The movements follow the same rules as move_disk(), using the measurements in geometry
+# (a tower_geometry for "height" discs if it is left out).
+def plan_dense_keyframes(height, frame_rate, start_locations, from_pole, to_pole, with_pole, geometry=None):
+    if geometry is None:
+        geometry = tower_geometry(height)
+
+    tracks = {}
+    x = {}
+    z = {}
+    bottom_z = {}
+    for disc in range(1, height + 1):
+        name = disc_name(disc)
+        start_x, start_y, start_z = start_locations[name]
+        tracks[name] = disc_track(name, start_y)
+        x[name] = start_x
+        z[name] = start_z
+        # The largest disc is on the bottom, so disc number "disc" starts at slot height - disc.
+        bottom_z[name] = start_z - geometry.slot_z[height - disc]
+
+    pole_sizes = {from_pole: height, to_pole: 0, with_pole: 0}
+    names = list(tracks)
+
+    def key_all(frame):
+        for name in names:
+            tracks[name].add(frame, x[name], z[name])
+
+    frame_count = 0
+    key_all(frame_count)
+
+    for disc, source_pole, destination_pole in hanoi_moves(height, from_pole, to_pole, with_pole):
+        name = disc_name(disc)
+
+        frame_count += frame_rate
+        z[name] = bottom_z[name] + geometry.lift
+        key_all(frame_count)
+
+        frame_count += frame_rate
+        x[name] += geometry.across(source_pole, destination_pole)
+        key_all(frame_count)
+
+        frame_count += frame_rate
+        z[name] = bottom_z[name] + geometry.slot_z[pole_sizes[destination_pole]]
+        key_all(frame_count)
+
+        pole_sizes[source_pole] -= 1
+        pole_sizes[destination_pole] += 1
+
+    return [tracks[name] for name in names]
+
+# This is the "sparse" version of plan_dense_keyframes().  Instead of keying every disc on
+# every step (which is what keep_other_discs_at_rest() does), only the disc that is moving
+# gets keyframes, so we end up with a handful of keyframes per move instead of 3 per disc.
+#
+# Between two moves of the same disc its keyframes have the same value, so the F-curve just
+# stays flat there (Blender lays the handles of a keyframe flat when it is the top or bottom
+# of a movement).  The one thing we do need is a "hold" keyframe right where the next move
+# starts, otherwise the disc would start drifting up from the end of its previous move.
+#
+# frame_start and frame_end let us plan just part of the animation, which is what each
+# worker does when rendering in chunks (see render_chunks.py).  We start from the last move
+# that finished at or before frame_start, take every disc's location there from
+# state_at_frame(), and stop after the move that is going on at frame_end.
+#
+# The moves themselves come from sparse_keyframe_moves() below.
+def plan_sparse_keyframes(height, frame_rate, start_locations, from_pole, to_pole, with_pole,
+                          frame_start=0, frame_end=None, geometry=None):
+    if geometry is None:
+        geometry = tower_geometry(height)
+
+    first_move, last_move = sparse_move_range(height, frame_rate, frame_start, frame_end)
+    states = state_at_frame(height, frame_rate, first_move * 3 * frame_rate, start_locations,
+                            from_pole, to_pole, with_pole, geometry)
+
+    tracks = {}
+    for state in states:
+        tracks[state.name] = disc_track(state.name, start_locations[state.name][1])
+        tracks[state.name].add(first_move * 3 * frame_rate, state.location[0], state.location[2])
+
+    for move_number, disc, source_pole, destination_pole, keys in sparse_keyframe_moves(
+            height, frame_rate, start_locations, from_pole, to_pole, with_pole, first_move, last_move, geometry):
+        track = tracks[disc_name(disc)]
+        for frame, x, z in keys:
+            track.add(frame, x, z)
+
+    return list(tracks.values())
+
+# The moves that plan_sparse_keyframes() needs for frame_start .. frame_end, as
+# (moves already done at the start, the last move to plan).
+def sparse_move_range(height, frame_rate, frame_start=0, frame_end=None):
+    frames_per_move = 3 * frame_rate
+    total_moves = (1 << height) - 1
+    first_move = min(int(frame_start // frames_per_move), total_moves)
+    if frame_end is None:
+        last_move = total_moves
+    else:
+        last_move = min(-int(-frame_end // frames_per_move), total_moves)
+    return (first_move, last_move)
+
+# This yields the sparse keyframes one move at a time, for moves first_move + 1 .. last_move,
+# as (move number, disc, from_pole, to_pole, keys), where keys is a list of (frame, x, z) for
+# the disc that moves: the hold keyframe if it needs one, then up, across and down.  It only
+# holds on to a few numbers per disc, so it can stream any number of moves (export_hanoi.py
+# writes them straight out to files this way).
+#
+# The discs start wherever state_at_frame() says they are after first_move moves.
+def sparse_keyframe_moves(height, frame_rate, start_locations, from_pole, to_pole, with_pole,
+                          first_move=0, last_move=None, geometry=None):
+    if geometry is None:
+        geometry = tower_geometry(height)
+    if last_move is None:
+        last_move = (1 << height) - 1
+
+    frame_count = first_move * 3 * frame_rate
+    states = state_at_frame(height, frame_rate, frame_count, start_locations, from_pole, to_pole, with_pole, geometry)
+
+    x = {}
+    z = {}
+    bottom_z = {}
+    last_key = {}
+    pole_sizes = {from_pole: 0, to_pole: 0, with_pole: 0}
+    for state in states:
+        name = state.name
+        x[name] = state.location[0]
+        z[name] = state.location[2]
+        bottom_z[name] = start_locations[name][2] - geometry.slot_z[height - state.disc]
+        last_key[name] = frame_count
+        pole_sizes[state.pole] += 1
+
+    moves = hanoi_moves(height, from_pole, to_pole, with_pole, first_move + 1)
+    for move_number in range(first_move + 1, last_move + 1):
+        disc, source_pole, destination_pole = next(moves)
+        name = disc_name(disc)
+        keys = []
+
+        if frame_count > last_key[name]:
+            keys.append((frame_count, x[name], z[name]))
+
+        frame_count += frame_rate
+        z[name] = bottom_z[name] + geometry.lift
+        keys.append((frame_count, x[name], z[name]))
+
+        frame_count += frame_rate
+        x[name] += geometry.across(source_pole, destination_pole)
+        keys.append((frame_count, x[name], z[name]))
+
+        frame_count += frame_rate
+        z[name] = bottom_z[name] + geometry.slot_z[pole_sizes[destination_pole]]
+        keys.append((frame_count, x[name], z[name]))
+
+        last_key[name] = frame_count
+        pole_sizes[source_pole] -= 1
+        pole_sizes[destination_pole] += 1
+        yield (move_number, disc, source_pole, destination_pole, keys)
+
+# How many keyframes plan_sparse_keyframes() gives disc number "disc" for the whole animation:
+# the one on frame 0, then 3 per move plus a hold keyframe before every move apart from the
+# very first one (disc 1 moves on frame 0, so it doesn't need one).
+def sparse_key_count(height, disc):
+    moves = 1 << (height - disc)
+    return 1 + 4 * moves - (1 if disc == 1 else 0)
+
+# This evaluates a disc_track channel at a given frame the same way Blender evaluates an
+# F-curve full of keyframes inserted with the default "auto clamped" bezier handles.
+#
+# Every keyframe we insert is either at the top or bottom of a movement (or sitting still),
+# so Blender lays both of its handles flat.  The only thing left that changes the shape of
+# a segment is how far the handles reach along the frame axis, which Blender works out as
+# (distance to the neighbouring keyframe) / 2.5614, but never more than 5 times the distance
+# to the keyframe on the other side.
+def sample_track(frames, values, frame):
+    if frame <= frames[0]:
+        return values[0]
+    if frame >= frames[-1]:
+        return values[-1]
+
+    # Binary search for the segment that the frame is in.
+    low = 0
+    high = len(frames) - 1
+    while high - low > 1:
+        middle = (low + high) // 2
+        if frames[middle] <= frame:
+            low = middle
+        else:
+            high = middle
+
+    start_value = values[low]
+    end_value = values[high]
+    if start_value == end_value:
+        return start_value
+
+    start_frame = frames[low]
+    end_frame = frames[high]
+    length = end_frame - start_frame
+    before = frames[low] - frames[low - 1] if low > 0 else length
+    after = frames[high + 1] - frames[high] if high + 1 < len(frames) else length
+    right_handle = min(length, 5 * before) / 2.5614
+    left_handle = min(length, 5 * after) / 2.5614
+
+    t = bezier_parameter(length, right_handle, length - left_handle, frame - start_frame)
+    return start_value + (end_value - start_value) * t * t * (3 - 2 * t)
+
+# Finds t for a point on a bezier segment running from 0 to "length" along the frame axis,
+# with handles at "first_handle" and "second_handle", by bisection.  The frame axis of our
+# segments always increases with t, so bisection always finds it.
+def bezier_parameter(length, first_handle, second_handle, offset):
+    low = 0.0
+    high = 1.0
+    for step in range(40):
+        t = (low + high) / 2
+        u = 1 - t
+        position = 3 * u * u * t * first_handle + 3 * u * t * t * second_handle + t * t * t * length
+        if position < offset:
+            low = t
+        else:
+            high = t
+    return (low + high) / 2
+
+# This is the check that the sparse keyframes make the exact same animation as the dense
+# ones.  It samples the x and z location of every disc on every single frame for both
+# versions and returns the first place they differ as (disc name, frame, dense, sparse),
+# or None if they match everywhere.
+def check_sparse_keyframes(dense_tracks, sparse_tracks):
+    sparse_by_name = {track.name: track for track in sparse_tracks}
+    for dense in dense_tracks:
+        sparse = sparse_by_name[dense.name]
+        for frame in range(int(dense.frames[0]), int(dense.frames[-1]) + 1):
+            for channel in ("x", "z"):
+                dense_value = sample_track(dense.frames, getattr(dense, channel), frame)
+                sparse_value = sample_track(sparse.frames, getattr(sparse, channel), frame)
+                if abs(dense_value - sparse_value) > 1e-4:
+                    return (dense.name, frame, dense_value, sparse_value)
+    return None
+
+# This takes the tracks from plan_dense_keyframes() and writes them into Blender.
+# Any location F-curves the disc already has are thrown away first, since the tracks
+# include frame 0 and will replace them completely.
+def write_keyframes_bulk(tracks):
+    import_bpy()
+    for track in tracks:
+        disc_object = bpy.data.objects[track.name]
+        if disc_object.animation_data is None:
+            disc_object.animation_data_create()
+        if disc_object.animation_data.action is None:
+            disc_object.animation_data.action = bpy.data.actions.new(name=track.name + "Action")
+        action = disc_object.animation_data.action
+
+        for index in range(3):
+            old_fcurve = action.fcurves.find('location', index=index)
+            if old_fcurve is not None:
+                action.fcurves.remove(old_fcurve)
+
+        count = track.size()
+        ys = array('f', [track.y]) * count
+        for index, values in ((0, track.x), (1, ys), (2, track.z)):
+            fcurve = action.fcurves.new(data_path='location', index=index, action_group="Object Transforms")
+            fcurve.keyframe_points.add(count)
+            fcurve.keyframe_points.foreach_set("co", track.co(values))
+            fcurve.update()
+
+        # Leave the disc where the animation ends, the same as keyframe_insert() would.
+        disc_object.location.x = track.x[-1]
+        disc_object.location.z = track.z[-1]
+
+# A disc_state is where one disc is at a particular frame.
+#   pole:     the tower it is on, or the tower it is leaving if it is in the air.
+#   level:    which slot it sits in on that tower, 1 being the bottom.
+#   phase:    None if it is sitting still, otherwise "up", "across" or "down".
+#   to_pole:  the tower it is heading to if it is in the air, otherwise None.
+#   location: its (x, y, z) location at that frame.
+class disc_state:
+    def __init__(self, disc, pole, level, phase, to_pole, location):
+        self.disc = disc
+        self.name = disc_name(disc)
+        self.pole = pole
+        self.level = level
+        self.phase = phase
+        self.to_pole = to_pole
+        self.location = location
+
+# This tells us where every disc is at any frame without replaying the animation from frame 0.
+# It returns a list of disc_state, one per disc, smallest disc first.
+#
+# Each move takes 3 * frame_rate frames, so frame // (3 * frame_rate) is the number of moves
+# that have already finished.  After m moves, disc i (counting from 0 for the smallest) has
+# moved (m + 2^i) >> (i + 1) times, and it always goes around the towers in the same
+# direction (the even numbered discs one way, the odd ones the other), so its tower is just
+# that count times its direction, mod 3.  Those tower numbers are the same ones hanoi_moves()
+# uses.  That is all the information we need, so this only costs a few steps per disc no
+# matter how far into the animation the frame is.
+#
+# start_locations works the same as in plan_dense_keyframes(); if it is left out, the
+# locations are relative to the bottom slot of from_pole.  The disc in the air is eased the
+# same way Blender eases between our keyframes, so this matches the rendered animation.
+def state_at_frame(height, frame_rate, frame, start_locations=None,
+                   from_pole="tower_a", to_pole="tower_b", with_pole="tower_c", geometry=None):
+    if geometry is None:
+        geometry = tower_geometry(height)
+
+    if height % 2 == 1:
+        pole_names = (from_pole, with_pole, to_pole)
+    else:
+        pole_names = (from_pole, to_pole, with_pole)
+
+    total_moves = (1 << height) - 1
+    frames_per_move = 3 * frame_rate
+    frame = max(frame, 0)
+    moves_done = min(int(frame // frames_per_move), total_moves)
+
+    # Which disc is in the air right now (if any), and how far into its move it is.
+    moving_disc = None
+    if moves_done < total_moves:
+        into_move = frame - moves_done * frames_per_move
+        if into_move > 0:
+            move_number = moves_done + 1
+            moving_disc = (move_number & -move_number).bit_length()
+            destination = ((move_number | (move_number - 1)) + 1) % 3
+            step = int(into_move // frame_rate)
+            phase = ("up", "across", "down")[step]
+            handle = frame_rate / 2.5614
+            t = bezier_parameter(frame_rate, handle, frame_rate - handle, into_move - step * frame_rate)
+            eased = t * t * (3 - 2 * t)
+
+    # Go from the biggest disc to the smallest, so that we can count how many discs are
+    # already on each tower underneath the current one.
+    pole_sizes = [0, 0, 0]
+    states = []
+    for disc in range(height, 0, -1):
+        index = disc - 1
+        direction = -1 if index % 2 == 0 else 1
+        peg = (direction * ((moves_done + (1 << index)) >> (index + 1))) % 3
+        pole_sizes[peg] += 1
+        level = pole_sizes[peg]
+
+        if start_locations is None:
+            start_x, start_y, bottom_z = (0.0, 0.0, 0.0)
+        else:
+            start_x, start_y, start_z = start_locations[disc_name(disc)]
+            bottom_z = start_z - geometry.slot_z[height - disc]
+
+        x = start_x + geometry.across(from_pole, pole_names[peg])
+        z = bottom_z + geometry.slot_z[level - 1]
+
+        if disc == moving_disc:
+            # Every disc on the destination tower is bigger than this one, so they have
+            # all been counted already.
+            landing_z = bottom_z + geometry.slot_z[pole_sizes[destination]]
+            across = geometry.across(pole_names[peg], pole_names[destination])
+            if phase == "up":
+                z += (bottom_z + geometry.lift - z) * eased
+            elif phase == "across":
+                z = bottom_z + geometry.lift
+                x += across * eased
+            else:
+                x += across
+                z = bottom_z + geometry.lift + (landing_z - bottom_z - geometry.lift) * eased
+            states.append(disc_state(disc, pole_names[peg], level, phase, pole_names[destination], (x, start_y, z)))
+        else:
+            states.append(disc_state(disc, pole_names[peg], level, None, None, (x, start_y, z)))
+
+    states.reverse()
+    return states
+
+# plan_cache saves keyframe plans (the disc_track lists from plan_dense_keyframes() and
+# plan_sparse_keyframes()) to disk, so that building the same animation again doesn't have
+# to work every move out all over again.
+#
+# Each plan goes in its own file, named after a hash of everything that goes into making it
+# (height, frame rate, where the discs start, the towers, the geometry and so on), so if any
+# of those change we just won't find a file for it.  The file is laid out like this:
+#   header:    magic bytes, plan_cache_version, number of tracks
+#   per track: name length, y, number of keyframes, the name, padding so the floats start
+#              on a multiple of 4 bytes from the start of the file, then the frames, x and
+#              z values as 4 byte floats
+#
+# Loading maps the file into memory with mmap and the tracks just point into it, so nothing
+# gets copied or parsed apart from the small headers.  Files from an older
+# plan_cache_version, and files that are cut short or otherwise broken, are thrown away
+# instead of being used.
+#
+# The folder is kept under max_bytes by deleting the plans that were used least recently.
+plan_cache_version = 2
+plan_cache_magic = b"TOHPLAN\0"
+
+class plan_cache:
+    def __init__(self, folder=None, max_bytes=1 << 30):
+        if folder is None:
+            folder = os.path.join(os.path.expanduser("~"), ".cache", "tower_of_hanoi")
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+    # Works out the file name for a plan from everything that was used to make it.
+    def key(self, *parameters):
+        text = repr((plan_cache_version,) + parameters)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.folder, key + ".plan")
+
+    # Returns the list of disc_track for "key", or None if we don't have it (or it's stale).
+    def load(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as plan_file:
+                mapped = mmap.mmap(plan_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            return None
+        except ValueError:
+            # mmap can't map an empty file.
+            os.remove(path)
+            return None
+
+        try:
+            tracks = self.read_tracks(mapped)
+        except (ValueError, TypeError, struct.error):
+            tracks = None
+        if tracks is None:
+            mapped.close()
+            os.remove(path)
+            return None
+
+        # Touching the file marks it as just used, for deciding what to delete first.
+        os.utime(path)
+        return tracks
+
+    def read_tracks(self, mapped):
+        magic, version, track_count = struct.unpack_from("<8sII", mapped, 0)
+        if magic != plan_cache_magic or version != plan_cache_version:
+            return None
+
+        view = memoryview(mapped)
+        offset = struct.calcsize("<8sII")
+        tracks = []
+        for track_number in range(track_count):
+            name_length, y, count = struct.unpack_from("<HdQ", mapped, offset)
+            offset += struct.calcsize("<HdQ")
+            name = bytes(view[offset:offset + name_length]).decode("utf-8")
+            offset += name_length
+            offset += -offset % 4
+            if offset + 12 * count > len(mapped):
+                return None
+
+            track = disc_track(name, y)
+            track.frames = view[offset:offset + 4 * count].cast('f')
+            offset += 4 * count
+            track.x = view[offset:offset + 4 * count].cast('f')
+            offset += 4 * count
+            track.z = view[offset:offset + 4 * count].cast('f')
+            offset += 4 * count
+            tracks.append(track)
+        return tracks
+
+    def save(self, key, tracks):
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.path(key)
+
+        # Write to a temporary file and then rename it, so a half written plan is never loaded.
+        temporary_path = path + "." + str(os.getpid()) + ".tmp"
+        with open(temporary_path, "wb") as plan_file:
+            plan_file.write(struct.pack("<8sII", plan_cache_magic, plan_cache_version, len(tracks)))
+            for track in tracks:
+                name = track.name.encode("utf-8")
+                plan_file.write(struct.pack("<HdQ", len(name), track.y, track.size()))
+                plan_file.write(name + bytes(-(plan_file.tell() + len(name)) % 4))
+                for values in (track.frames, track.x, track.z):
+                    plan_file.write(array('f', values).tobytes())
+        os.replace(temporary_path, path)
+
+        self.evict(keep=path)
+
+    # Deletes the least recently used plans until the folder is under max_bytes.
+    def evict(self, keep=None):
+        plans = []
+        total = 0
+        for file_name in os.listdir(self.folder):
+            if file_name.endswith(".plan"):
+                path = os.path.join(self.folder, file_name)
+                details = os.stat(path)
+                plans.append((details.st_mtime, details.st_size, path))
+                total += details.st_size
+
+        plans.sort()
+        for modified, size, path in plans:
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                os.remove(path)
+                total -= size
+
+# This is what move_tower_bulk() uses to get its plan.  It's the same as calling
+# plan_sparse_keyframes() or plan_dense_keyframes(), except that if cache (a plan_cache)
+# is given, it looks for the plan there first and saves it there if it had to work it out.
+def plan_keyframes(height, frame_rate, start_locations, from_pole, to_pole, with_pole,
+                   sparse=False, geometry=None, cache=None):
+    if geometry is None:
+        geometry = tower_geometry(height)
+
+    if cache is not None:
+        key = cache.key("sparse" if sparse else "dense", height, frame_rate, sorted(start_locations.items()),
+                        from_pole, to_pole, with_pole, geometry.discs, geometry.disc_thickness,
+                        geometry.peg_height, geometry.clearance, tuple(geometry.pole_x))
+        tracks = cache.load(key)
+        if tracks is not None:
+            return tracks
+
+    if sparse:
+        tracks = plan_sparse_keyframes(height, frame_rate, start_locations, from_pole, to_pole, with_pole,
+                                       geometry=geometry)
+    else:
+        tracks = plan_dense_keyframes(height, frame_rate, start_locations, from_pole, to_pole, with_pole, geometry)
+
+    if cache is not None:
+        cache.save(key, tracks)
+    return tracks
+
+# This is plan_sparse_keyframes() squeezed into at most frame_budget frames.  It returns
+# (tracks, the last frame), and the last frame is never more than frame_budget.
+#
+# The normal animation takes 3 * frame_rate * (2^height - 1) frames, which is way too long to
+# render for big heights.  So:
+#   - The c smallest discs are grouped into a sub-tower that moves as one piece.  Every
+#     2^c - 1 moves of them in the normal animation just move that whole sub-tower from one
+#     tower to another, so we show that as a single move, where the sub-tower lifts up, goes
+#     across and comes down together.  Between those, the bigger discs move one at a time
+#     like normal.  That leaves 2^(height - c) sub-tower moves and 2^(height - c) - 1 other
+#     ones, and we pick the smallest c that leaves at least 1 frame for each step.
+#   - The budget is shared out evenly between the moves that are left, so each step takes
+#     frame_rate frames if there is room and less if there isn't.  If it all fits, nothing is
+#     grouped and this gives the same keyframes as plan_sparse_keyframes().
+#   - Every keyframe is rounded to a whole frame, so they all land on frames that get rendered.
+# So the number of keyframes grows with the budget instead of with 2^height.
+#
+# Moving the sub-tower in one piece isn't a legal move in the puzzle, so check_keyframe_arrays()
+# only passes this when nothing got grouped.
+def plan_compressed_keyframes(height, frame_budget, start_locations, from_pole, to_pole, with_pole,
+                              frame_rate=24, geometry=None):
+    if geometry is None:
+        geometry = tower_geometry(height)
+
+    grouped = 0
+    while True:
+        moves = (1 << (height - grouped)) - 1 + (1 << (height - grouped) if grouped else 0)
+        if 3 * moves <= frame_budget or grouped == height:
+            break
+        grouped += 1
+    if 3 * moves > frame_budget:
+        raise ValueError("a frame budget of " + str(frame_budget) + " frames is too short, it needs at least "
+                         + str(3 * moves))
+    step_frames = min(frame_rate, frame_budget / (3 * moves))
+
+    if height % 2 == 1:
+        pole_names = (from_pole, with_pole, to_pole)
+    else:
+        pole_names = (from_pole, to_pole, with_pole)
+
+    tracks = {}
+    x = {}
+    z = {}
+    bottom_z = {}
+    for disc in range(1, height + 1):
+        name = disc_name(disc)
+        start_x, start_y, start_z = start_locations[name]
+        tracks[name] = disc_track(name, start_y)
+        x[name] = start_x
+        z[name] = start_z
+        bottom_z[name] = start_z - geometry.slot_z[height - disc]
+        tracks[name].add(0, start_x, start_z)
+    pole_sizes = {from_pole: height, to_pole: 0, with_pole: 0}
+
+    # steps counts the steps so far, and the frame each one ends on is rounded from that.
+    steps = 0
+
+    # Moves the discs numbered first_disc .. last_disc (which are stacked up together) from
+    # source_pole to destination_pole in 3 steps.
+    def move_discs(first_disc, last_disc, source_pole, destination_pole):
+        nonlocal steps
+        names = [disc_name(disc) for disc in range(first_disc, last_disc + 1)]
+        bottom_name = names[-1]
+        frame = round(steps * step_frames)
+        for name in names:
+            if frame > tracks[name].frames[-1]:
+                tracks[name].add(frame, x[name], z[name])
+
+        # Everything moves by the same amount as the bottom disc of the group.
+        lift = bottom_z[bottom_name] + geometry.lift - z[bottom_name]
+        across = geometry.across(source_pole, destination_pole)
+        drop = bottom_z[bottom_name] + geometry.slot_z[pole_sizes[destination_pole]] - z[bottom_name] - lift
+        for dx, dz in ((0, lift), (across, 0), (0, drop)):
+            steps += 1
+            frame = round(steps * step_frames)
+            for name in names:
+                x[name] += dx
+                z[name] += dz
+                tracks[name].add(frame, x[name], z[name])
+
+        pole_sizes[source_pole] -= len(names)
+        pole_sizes[destination_pole] += len(names)
+
+    sub_tower_pole = from_pole
+    group = 1 << grouped
+    for block in range(1 << (height - grouped)):
+        if grouped:
+            # Where disc "grouped" (the bottom of the sub-tower) is once this block of moves is
+            # done, the same way state_at_frame() works it out.
+            done = (block + 1) * group - 1
+            index = grouped - 1
+            direction = -1 if index % 2 == 0 else 1
+            next_pole = pole_names[(direction * ((done + (1 << index)) >> (index + 1))) % 3]
+            move_discs(1, grouped, sub_tower_pole, next_pole)
+            sub_tower_pole = next_pole
+
+        if block + 1 < 1 << (height - grouped):
+            move_number = (block + 1) * group
+            disc = (move_number & -move_number).bit_length()
+            source_pole = pole_names[(move_number & (move_number - 1)) % 3]
+            destination_pole = pole_names[((move_number | (move_number - 1)) + 1) % 3]
+            move_discs(disc, disc, source_pole, destination_pole)
+
+    return (list(tracks.values()), round(steps * step_frames))
+
+# Everything below up to move_trace checks that a plan or an animation is legal:
+#   - no disc ever goes on top of a smaller one, and only the top disc of a tower moves,
+#   - no disc teleports (it always leaves from the tower it is on, and only moves one way at
+#     a time, going across only at the top of its lift),
+#   - only one disc is moving at a time.
+#
+# They work on NumPy arrays and check each rule for every move at once, so there is no Python
+# loop per move, which is what lets them check 2^24 moves in a few seconds.  NumPy comes with
+# Blender, but we only import it in here so the rest of the script doesn't need it.
+#
+# They all return None if everything is fine, otherwise (frame, what went wrong) for the
+# first frame where something goes wrong.
+
+# The same moves as hanoi_moves(), as 3 NumPy arrays (disc, source tower, destination tower)
+# with tower numbers instead of names.
+def hanoi_move_arrays(height, from_tower=0, to_tower=1, with_tower=2):
+    import numpy as np
+
+    move_numbers = np.arange(1, 1 << height, dtype=np.int32 if height < 31 else np.int64)
+    # frexp() splits 2^k into 0.5 * 2^(k + 1), so the exponent is already the disc number.
+    discs = np.frexp(move_numbers & -move_numbers)[1].astype(np.int8)
+    if height % 2 == 1:
+        towers = np.array([from_tower, with_tower, to_tower], dtype=np.int8)
+    else:
+        towers = np.array([from_tower, to_tower, with_tower], dtype=np.int8)
+    sources = towers[(move_numbers & (move_numbers - 1)) % 3]
+    destinations = towers[((move_numbers | (move_numbers - 1)) + 1) % 3]
+    return (discs, sources, destinations)
+
+# Checks a list of moves, given as arrays of disc numbers, source towers and destination
+# towers, one entry per move in the order they happen.  start_towers[disc - 1] is the tower
+# each disc starts on (all on tower 0 if it is left out), and if end_tower is given every
+# disc has to finish there.
+#
+# move_frames is the frame each move starts on, for reporting problems; if it is left out
+# the moves are taken to be 3 * frame_rate frames long, like move_disk() makes them.
+#
+# For the "only move the top disc, and never on to a smaller one" rule, a disc can only move
+# when every smaller disc is on the third tower.  So for each disc (not each move), we work out
+# which tower it is on at every move of a bigger disc and check it isn't in the way.  Once a
+# disc is checked its moves aren't needed any more, so we drop them, and for a normal plan
+# (where disc d moves half as often as disc d - 1) that comes to about 2 passes over the moves.
+def check_move_arrays(discs, sources, destinations, start_towers=None, end_tower=None, towers=3,
+                      move_frames=None, frame_rate=24):
+    import numpy as np
+
+    discs = np.asarray(discs)
+    sources = np.asarray(sources)
+    destinations = np.asarray(destinations)
+    height = int(discs.max()) if len(discs) else 0
+    if start_towers is None:
+        start_towers = np.zeros(height, dtype=np.int8)
+    start_towers = np.asarray(start_towers)
+    height = len(start_towers)
+
+    # Each problem we find is (move index, what went wrong); we only keep the first of each kind.
+    problems = []
+
+    def first(bad, moves, message):
+        found = np.flatnonzero(bad)
+        if len(found):
+            problems.append((int(moves[found[0]]), message(found[0])))
+
+    def earliest_problem():
+        if not problems:
+            return None
+        move, message = min(problems, key=lambda problem: problem[0])
+        if move_frames is None or move >= len(move_frames):
+            frame = 3 * frame_rate * move
+        else:
+            frame = move_frames[move]
+        return (int(frame), "move " + str(move + 1) + ": " + message)
+
+    all_moves = np.arange(len(discs))
+    first((discs < 1) | (discs > len(start_towers)), all_moves,
+          lambda at: "there is no disc " + str(discs[at]))
+    first((sources < 0) | (sources >= towers) | (destinations < 0) | (destinations >= towers), all_moves,
+          lambda at: "there is no tower " + str(max(sources[at], destinations[at])))
+    first(sources == destinations, all_moves, lambda at: "disc " + str(discs[at]) + " moves on to the same tower")
+
+    # Moves of discs or towers that don't exist can't be followed any further.
+    if problems:
+        return earliest_problem()
+
+    moves = all_moves
+    for disc in range(1, height + 1):
+        start_tower = start_towers[disc - 1]
+        if not len(moves):
+            if end_tower is not None and start_tower != end_tower:
+                problems.append((max(len(all_moves) - 1, 0), "disc " + str(disc) + " doesn't end up on tower "
+                                 + str(end_tower)))
+            continue
+        mine = discs == disc
+
+        # It has to leave from wherever its last move left it.
+        my_moves = np.flatnonzero(mine)
+        my_sources = sources[my_moves]
+        my_destinations = destinations[my_moves]
+        came_from = np.concatenate(([start_tower], my_destinations[:-1]))
+        first(my_sources != came_from, moves[my_moves],
+              lambda at: "disc " + str(disc) + " leaves tower " + str(my_sources[at])
+                         + " but it is on tower " + str(came_from[at]))
+
+        # Which tower it is on when each of the other moves happens: the destination of its
+        # last move before then (or where it started, if it hasn't moved yet).
+        last_move = np.where(mine, np.arange(len(moves)), -1)
+        np.maximum.accumulate(last_move, out=last_move)
+        tower = np.where(last_move >= 0, destinations[last_move], start_tower)
+        first(~mine & ((tower == sources) | (tower == destinations)), moves,
+              lambda at: "disc " + str(discs[at]) + " moves from tower " + str(sources[at]) + " to tower "
+                         + str(destinations[at]) + " with disc " + str(disc) + " in the way")
+
+        # tower[-1] is where it ends up, even if the last move is its own.  That is only
+        # wrong once the whole plan is over, so that's where it gets reported.
+        if end_tower is not None and tower[-1] != end_tower:
+            problems.append((max(len(all_moves) - 1, 0), "disc " + str(disc) + " doesn't end up on tower " + str(end_tower)))
+
+        keep = ~mine
+        moves = moves[keep]
+        discs = discs[keep]
+        sources = sources[keep]
+        destinations = destinations[keep]
+
+    return earliest_problem()
+
+# This is check_move_arrays() for the tracks from plan_dense_keyframes() or
+# plan_sparse_keyframes() (or read_keyframe_tracks(), for what is actually in Blender).
+# The discs have to start out stacked up on from_tower, and the tower positions come from
+# geometry (the default tower_geometry if it is left out).
+#
+# First each track is checked on its own: between two keyframes a disc either goes up or
+# down, or goes across at its lifted height, never both, and never jumps between two
+# keyframes on the same frame.  Then all of the times that discs are moving are sorted by
+# when they start, and each one has to start after all of the ones before it have finished.
+# Last of all every move across is turned back into a move between towers, and the list of
+# moves goes through check_move_arrays().
+def check_keyframe_arrays(tracks, from_tower=0, end_tower=None, geometry=None):
+    import numpy as np
+
+    if geometry is None:
+        geometry = tower_geometry(len(tracks))
+    pole_x = np.asarray(geometry.pole_x, dtype=np.float64)
+
+    problems = []
+    moving_starts = []
+    moving_ends = []
+    moving_discs = []
+    move_discs = []
+    move_frames = []
+    move_sources = []
+    move_destinations = []
+    for track in tracks:
+        disc = int(track.name[len("ring_size_"):])
+        frames = np.asarray(track.frames, dtype=np.float64)
+        x = np.asarray(track.x, dtype=np.float64)
+        z = np.asarray(track.z, dtype=np.float64)
+
+        moves_x = np.abs(np.diff(x)) > 1e-4
+        moves_z = np.abs(np.diff(z)) > 1e-4
+        moving = moves_x | moves_z
+        lift = z.max()
+
+        jumps = np.flatnonzero(moving & (np.diff(frames) <= 0))
+        if len(jumps):
+            problems.append((frames[jumps[0]], track.name + " jumps to a new location without taking any time"))
+        backwards = np.flatnonzero(~moving & (np.diff(frames) < 0))
+        if len(backwards):
+            problems.append((frames[backwards[0]], track.name + " has keyframes out of order"))
+        diagonal = np.flatnonzero(moves_x & moves_z)
+        if len(diagonal):
+            problems.append((frames[diagonal[0]], track.name + " moves across and up or down at once"))
+        low = np.flatnonzero(moves_x & (np.abs(z[:-1] - lift) > 1e-4))
+        if len(low):
+            problems.append((frames[low[0]], track.name + " moves across without being lifted up first"))
+
+        segments = np.flatnonzero(moving)
+        moving_starts.append(frames[segments])
+        moving_ends.append(frames[segments + 1])
+        moving_discs.append(np.full(len(segments), disc))
+
+        # Turn the x locations back into towers, counting from where the disc started.
+        across = np.flatnonzero(moves_x)
+        offsets = pole_x[from_tower] + x - x[0]
+        nearest = np.abs(offsets[:, None] - pole_x[None, :]).argmin(axis=1)
+        between = np.flatnonzero(np.abs(offsets - pole_x[nearest]) > 1e-3)
+        if len(between):
+            problems.append((frames[between[0]], track.name + " stops in between two towers"))
+        move_discs.append(np.full(len(across), disc, dtype=np.int8))
+        move_frames.append(frames[across])
+        move_sources.append(nearest[across])
+        move_destinations.append(nearest[across + 1])
+
+    if moving_starts:
+        starts = np.concatenate(moving_starts)
+        ends = np.concatenate(moving_ends)
+        owners = np.concatenate(moving_discs)
+        order = np.lexsort((ends, starts))
+        starts = starts[order]
+        ends = ends[order]
+        owners = owners[order]
+        # The latest finish out of all of the movements that started before each one, and
+        # which movement that was.
+        finished = np.maximum.accumulate(ends)
+        latest = np.maximum.accumulate(np.where(ends == finished, np.arange(len(ends)), 0))
+        overlap = np.flatnonzero(starts[1:] < finished[:-1])
+        if len(overlap):
+            at = overlap[0] + 1
+            problems.append((starts[at], "ring_size_" + str(owners[at]) + " starts moving while ring_size_"
+                             + str(owners[latest[at - 1]]) + " is still moving"))
+
+        frames = np.concatenate(move_frames)
+        order = np.argsort(frames, kind="stable")
+        problem = check_move_arrays(np.concatenate(move_discs)[order], np.concatenate(move_sources)[order],
+                                    np.concatenate(move_destinations)[order],
+                                    np.full(len(tracks), from_tower, dtype=np.int8), end_tower,
+                                    len(pole_x), frames[order])
+        if problem is not None:
+            problems.append(problem)
+
+    if not problems:
+        return None
+    frame, message = min(problems, key=lambda problem: problem[0])
+    return (int(frame), message)
+
+# Reads the location keyframes of discs 1 .. discs back out of Blender as disc_tracks, with
+# NumPy arrays in them, for check_keyframe_arrays().  foreach_get() copies each F-curve out
+# in one go.  The x and z F-curves have keyframes on the same frames, since keyframe_insert()
+# and write_keyframes_bulk() both key all 3 at once.
+def read_keyframe_tracks(discs):
+    import numpy as np
+
+    import_bpy()
+    tracks = []
+    for disc in range(1, discs + 1):
+        disc_object = bpy.data.objects[disc_name(disc)]
+        action = disc_object.animation_data.action
+        track = disc_track(disc_object.name, disc_object.location.y)
+        for index, attribute in ((0, "x"), (2, "z")):
+            points = action.fcurves.find('location', index=index).keyframe_points
+            co = np.empty(2 * len(points), dtype=np.float32)
+            points.foreach_get("co", co)
+            track.frames = co[0::2]
+            setattr(track, attribute, co[1::2])
+        tracks.append(track)
+    return tracks
+
+# move_trace is a record of what move_disk() did, for debugging.
+#
+# It used to build up a long string on every move, which cost time even when nobody looked
+# at it.  Now, unless a trace is switched on with hanoi.enable_trace(), move_disk() doesn't
+# record anything at all.  When it is on, every step of every move is saved as one event:
+#   move:   the move number (1 is the first move)
+#   disc:   the disc number that moved
+#   phase:  "up", "across" or "down"
+#   frame:  the frame the keyframe went on
+#   amount: how far it moved (along z for up and down, along x for across)
+#
+# The events go into fixed size arrays that wrap around once they are full, so a trace
+# only ever keeps the last "capacity" events and never grows, no matter how many moves
+# there are.
+trace_phases = ("up", "across", "down")
+
+class move_trace:
+    __slots__ = ("capacity", "count", "moves", "discs", "phases", "frames", "amounts")
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.count = 0
+        self.moves = array('l', bytes(array('l').itemsize * capacity))
+        self.discs = array('l', bytes(array('l').itemsize * capacity))
+        self.phases = bytearray(capacity)
+        self.frames = array('d', bytes(8 * capacity))
+        self.amounts = array('d', bytes(8 * capacity))
+
+    # phase is 0, 1 or 2 for up, across and down.
+    def record(self, move, disc, phase, frame, amount):
+        slot = self.count % self.capacity
+        self.moves[slot] = move
+        self.discs[slot] = disc
+        self.phases[slot] = phase
+        self.frames[slot] = frame
+        self.amounts[slot] = amount
+        self.count += 1
+
+    # Gives back the events we still have, oldest first, as (move, disc, phase, frame, amount).
+    def events(self):
+        kept = min(self.count, self.capacity)
+        for index in range(self.count - kept, self.count):
+            slot = index % self.capacity
+            yield (self.moves[slot], self.discs[slot], trace_phases[self.phases[slot]],
+                   self.frames[slot], self.amounts[slot])
+
+    # Writes one JSON object per line to output_file (anything with a write() method).
+    def write_json_lines(self, output_file):
+        import json
+
+        for move, disc, phase, frame, amount in self.events():
+            axis = "dx" if phase == "across" else "dz"
+            output_file.write(json.dumps({"move": move, "disc": disc, "phase": phase,
+                                          "frame": frame, axis: amount}) + "\n")
+
+    # The events written out as text, one line per event, for showing in a text object.
+    def text(self):
+        lines = []
+        for move, disc, phase, frame, amount in self.events():
+            lines.append("Move " + str(move) + ": " + disc_name(disc) + " " + phase + " by " + str(amount)
+                         + " at frame " + str(frame))
+        return "\n".join(lines)
+
+# build_stats is where the hanoi class counts up what building the animation cost, once
+# hanoi.enable_stats() has been called.  Like the trace, while it's off the only cost is
+# checking "if stats is not None" a few times per move.
+#
+# Counters:
+#   moves:            how many moves were animated.
+#   active_keyframes: keyframes put on the disc that is moving.
+#   hold_keyframes:   keyframes keep_other_discs_at_rest() put on the discs that aren't.
+#   bulk_keyframes:   keyframes written all at once by move_tower_bulk() and friends.
+#   bpy_calls:        calls into Blender (object lookups, keyframe_insert() and so on).
+#
+# Timers (seconds and how many times, per phase):
+#   solve:        working out the next move.
+#   lift, traverse, drop: the 3 steps of move_disk(), not counting their hold keyframes.
+#   hold:         the keep_other_discs_at_rest() part of lift, traverse and drop.
+# None of the phases overlap, so adding them all up gives the whole build time.
+#   plan, write:  working out the keyframes and writing them to Blender, for the bulk builds.
+#   initial_keys, text_setup: the first keyframes and the debug text object, in hanoi().
+stats_phases = ("solve", "lift", "traverse", "drop", "hold", "plan", "write", "initial_keys", "text_setup")
+
+class build_stats:
+    __slots__ = ("moves", "active_keyframes", "hold_keyframes", "bulk_keyframes", "bpy_calls", "seconds", "calls",
+                 "hold_counted")
+
+    def __init__(self):
+        self.moves = 0
+        self.active_keyframes = 0
+        self.hold_keyframes = 0
+        self.bulk_keyframes = 0
+        self.bpy_calls = 0
+        self.seconds = dict.fromkeys(stats_phases, 0.0)
+        self.calls = dict.fromkeys(stats_phases, 0)
+        # How much of the hold time end_phase() has already taken out of other phases.
+        self.hold_counted = 0.0
+
+    def add_time(self, phase, seconds):
+        self.seconds[phase] += seconds
+        self.calls[phase] += 1
+
+    # Adds the time since start_time to "phase", leaving out the hold time added since the
+    # last end_phase(), since that is already counted under "hold".  Returns the time now,
+    # for the next phase to start from.
+    def end_phase(self, phase, start_time):
+        now = time.perf_counter()
+        hold = self.seconds["hold"]
+        self.add_time(phase, now - start_time - (hold - self.hold_counted))
+        self.hold_counted = hold
+        return now
+
+    def as_dict(self):
+        return {"moves": self.moves, "active_keyframes": self.active_keyframes,
+                "hold_keyframes": self.hold_keyframes, "bulk_keyframes": self.bulk_keyframes,
+                "bpy_calls": self.bpy_calls, "seconds": dict(self.seconds), "calls": dict(self.calls)}
+
+    def write_json(self, output_file):
+        import json
+
+        json.dump(self.as_dict(), output_file, indent=1)
+        output_file.write("\n")
+
+    # Writes the timers out the same way cProfile does, so they can be looked at with
+    # pstats.Stats(path).sort_stats("tottime").print_stats() or any tool that reads .prof
+    # files.  Each phase shows up as a function called "<phase>" in this file, and since the
+    # phases don't overlap, the total is the whole build time.
+    def write_pstats(self, path):
+        import marshal
+
+        entries = {}
+        for phase in stats_phases:
+            if self.calls[phase]:
+                seconds = self.seconds[phase]
+                entries[(os.path.abspath(__file__), 0, "<" + phase + ">")] = (self.calls[phase], self.calls[phase],
+                                                                               seconds, seconds, {})
+        with open(path, "wb") as output_file:
+            marshal.dump(entries, output_file)
+
+    # A few lines of text, for printing.
+    def text(self):
+        lines = ["moves: " + str(self.moves) + ", keyframes: " + str(self.active_keyframes) + " active, "
+                 + str(self.hold_keyframes) + " hold, " + str(self.bulk_keyframes) + " bulk, bpy calls: "
+                 + str(self.bpy_calls)]
+        for phase in stats_phases:
+            if self.calls[phase]:
+                lines.append("%-12s %10.6f s in %d calls" % (phase, self.seconds[phase], self.calls[phase]))
+        return "\n".join(lines)
+
+# move_captions shows what is going on while the animation plays, like "Lifting ring_size_2
+# off of tower_a", in one text object.
+#
+# Keyframing the text would need a keyframe (or a text object) per move, so instead we
+# change the text from a frame_change_pre handler, which Blender calls every time the frame
+# changes.  To make that cheap, everything is worked out up front:
+#   captions: every different caption, each one only once.  sys.intern() makes them
+#             interned strings, so checking whether the caption changed is just "is".
+#   steps:    one entry per step of each move (3 per move, frame_rate frames each), holding
+#             which caption to show during it.
+# So for any frame the caption is captions[steps[frame // frame_rate]], and there are only
+# a few captions per disc and tower, so steps (2 bytes per step) is most of the memory.
+#
+# moves are (disc, from_pole, to_pole) like hanoi_moves() gives, starting at first_frame.
+caption_words = {"up": ("Lifting ", " off of "), "across": ("Moving ", " over to "), "down": ("Dropping ", " on to ")}
+
+class move_captions:
+    __slots__ = ("frame_rate", "first_frame", "captions", "steps", "shown", "text", "handler")
+
+    def __init__(self, moves, frame_rate=24, first_frame=0):
+        self.frame_rate = frame_rate
+        self.first_frame = first_frame
+        self.captions = [sys.intern(""), sys.intern("Done!")]
+        self.steps = array('H')
+        self.shown = None
+        self.text = None
+        self.handler = None
+
+        numbers = {}
+        for disc, from_pole, to_pole in moves:
+            for phase, pole in (("up", from_pole), ("across", to_pole), ("down", to_pole)):
+                key = (phase, disc, pole)
+                number = numbers.get(key)
+                if number is None:
+                    before, after = caption_words[phase]
+                    number = len(self.captions)
+                    numbers[key] = number
+                    self.captions.append(sys.intern(before + disc_name(disc) + after + pole))
+                self.steps.append(number)
+
+    # The caption for a frame: nothing before the first move, and "Done!" after the last one.
+    def caption(self, frame):
+        step = (int(frame) - self.first_frame) // self.frame_rate
+        if step < 0:
+            return self.captions[0]
+        if step >= len(self.steps):
+            return self.captions[1]
+        return self.captions[self.steps[step]]
+
+    # Shows the captions in text (a text object's data, like hanoi.tcu) as the frame changes.
+    def install(self, text):
+        import_bpy()
+        self.remove()
+        self.text = text
+        self.shown = None
+
+        def update_caption(scene, *arguments):
+            caption = self.caption(scene.frame_current)
+            if caption is not self.shown:
+                self.shown = caption
+                self.text.body = caption
+
+        self.handler = update_caption
+        bpy.app.handlers.frame_change_pre.append(update_caption)
+        update_caption(bpy.context.scene)
+
+    def remove(self):
+        if self.handler is not None:
+            if self.handler in bpy.app.handlers.frame_change_pre:
+                bpy.app.handlers.frame_change_pre.remove(self.handler)
+            self.handler = None
+
+# The discs in tower_of_hanoi.blend were made by hand, and there are only 3 of them.
+# build_discs() makes any number of discs instead, named "ring_size_1" up to "ring_size_<discs>"
+# like the hand made ones, and stacked up on tower_a, so the hanoi class can just use them.
+#
+# Every disc is an object using the same mesh (a ring 1 unit across and
+# geometry.disc_thickness tall), scaled to its own size, so 40 discs take up the same mesh
+# memory as 1.  The two materials, one with the wood texture and one with rusted_metal.jpg,
+# are only made (and their images only loaded) once, and the discs take turns using them.
+#
+# bottom is where the largest disc goes, (x, y, z).  If it is left out we put it where the
+# largest of the discs already in the scene is sitting, which is the bottom slot of tower_a in
+# our .blend file.  Any discs with the same names are replaced.
+#
+# The hole in the middle is hole_radius across on the smallest disc, so it fits around the
+# tower, and the others are scaled up evenly to largest_radius.
+disc_mesh_name = "hanoi_disc_mesh"
+disc_material_images = (("hanoi_disc_wood", "35-seamless-wood-texture.jpg"), ("hanoi_disc_metal", "rusted_metal.jpg"))
+
+def build_discs(discs, geometry=None, bottom=None, smallest_radius=1.0, largest_radius=2.25,
+                hole_radius=0.35, segments=32):
+    import_bpy()
+    if geometry is None:
+        geometry = tower_geometry(discs)
+
+    if bottom is None:
+        largest = scene_disc_count()
+        if largest:
+            location = bpy.data.objects[disc_name(largest)].location
+            bottom = (location.x, location.y, location.z)
+        else:
+            bottom = (0.0, 0.0, 0.0)
+
+    mesh = disc_mesh(geometry.disc_thickness, hole_radius / smallest_radius, segments)
+    materials = [disc_material(name, image) for name, image in disc_material_images]
+    if not mesh.materials:
+        mesh.materials.append(materials[0])
+
+    scene = bpy.context.scene
+    for disc in range(1, discs + 1):
+        name = disc_name(disc)
+        existing = bpy.data.objects.get(name)
+        if existing is not None:
+            bpy.data.objects.remove(existing, do_unlink=True)
+
+        disc_object = bpy.data.objects.new(name, mesh)
+        if discs > 1:
+            radius = smallest_radius + (largest_radius - smallest_radius) * (disc - 1) / (discs - 1)
+        else:
+            radius = largest_radius
+        disc_object.scale = (radius, radius, 1.0)
+        disc_object.location = (bottom[0], bottom[1], bottom[2] + geometry.slot_z[discs - disc])
+
+        # The material goes on the object instead of the mesh, since they all share the mesh.
+        disc_object.material_slots[0].link = 'OBJECT'
+        disc_object.material_slots[0].material = materials[disc % len(materials)]
+
+        # Blender 2.8 and up put objects in collections, older versions put them straight in the scene.
+        if hasattr(scene, "collection"):
+            scene.collection.objects.link(disc_object)
+        else:
+            scene.objects.link(disc_object)
+
+# How many discs the scene has, counting up from "ring_size_1" until one is missing.
+def scene_disc_count():
+    import_bpy()
+    count = 0
+    while bpy.data.objects.get(disc_name(count + 1)) is not None:
+        count += 1
+    return count
+
+# Makes sure the scene has exactly "discs" discs, for hanoi() and render_chunk().  With too
+# few, build_discs() makes them all.  With too many, the extra big ones would be left sitting
+# on tower_a underneath everything, so they are deleted and build_discs() makes a new, smaller
+# set on the same spot.
+def fit_discs(discs, geometry=None):
+    existing = scene_disc_count()
+    if existing == discs:
+        return
+
+    bottom = None
+    if existing > discs:
+        location = bpy.data.objects[disc_name(existing)].location
+        bottom = (location.x, location.y, location.z)
+        for disc in range(discs + 1, existing + 1):
+            bpy.data.objects.remove(bpy.data.objects[disc_name(disc)], do_unlink=True)
+    build_discs(discs, geometry, bottom)
+
+# The mesh every disc shares: a flat ring with a radius of 1, "thickness" tall and centred on
+# its origin, with a hole "hole" across in the middle.  It's only made the first time it's
+# asked for with these sizes; the sizes go in its name (after disc_mesh_name), so a different
+# thickness, hole or number of segments gets its own mesh instead of the old one.
+def disc_mesh(thickness, hole, segments):
+    import math
+
+    name = disc_mesh_name + "_%g_%g_%d" % (thickness, hole, segments)
+    mesh = bpy.data.meshes.get(name)
+    if mesh is not None:
+        return mesh
+
+    # For each of the "segments" steps around the ring there are 4 vertices: outside bottom,
+    # outside top, inside bottom and inside top.
+    vertices = []
+    for segment in range(segments):
+        angle = 2 * math.pi * segment / segments
+        x = math.cos(angle)
+        y = math.sin(angle)
+        for radius in (1.0, hole):
+            vertices.append((radius * x, radius * y, -thickness / 2))
+            vertices.append((radius * x, radius * y, thickness / 2))
+
+    faces = []
+    for segment in range(segments):
+        this = 4 * segment
+        after = 4 * ((segment + 1) % segments)
+        faces.append((this, after, after + 1, this + 1))              # outside
+        faces.append((this + 2, this + 3, after + 3, after + 2))      # inside
+        faces.append((this + 1, after + 1, after + 3, this + 3))      # top
+        faces.append((this, this + 2, after + 2, after))              # bottom
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.from_pydata(vertices, [], faces)
+    mesh.update()
+    return mesh
+
+# One of the disc materials, with "image" (from next to the .blend file) as its colour.
+# It's only made, and the image only loaded, the first time.  There is no UV map on the
+# disc mesh, so the texture goes on with the "Generated" texture coordinates.
+def disc_material(name, image):
+    material = bpy.data.materials.get(name)
+    if material is not None:
+        return material
+
+    material = bpy.data.materials.new(name)
+    material.use_nodes = True
+    nodes = material.node_tree.nodes
+    texture = nodes.new("ShaderNodeTexImage")
+    texture.image = bpy.data.images.load(bpy.path.abspath("//" + image), check_existing=True)
+    coordinates = nodes.new("ShaderNodeTexCoord")
+    # The default shader is a Principled BSDF from Blender 2.8 on, and a Diffuse BSDF before
+    # that.  Either way its colour is the first input.
+    shader = [node for node in nodes if node.type in ("BSDF_PRINCIPLED", "BSDF_DIFFUSE")][0]
+    material.node_tree.links.new(coordinates.outputs["Generated"], texture.inputs["Vector"])
+    material.node_tree.links.new(texture.outputs["Color"], shader.inputs[0])
+    return material
+
 # This is the main class that does just about everything that we need to do.
 # This is invoked at the very bottom of the script something like this:
 
@@ -53,36 +1751,63 @@ class stack_with_hole_on_right:
 # hanoi_object.move_tower (3, "tower_a", "tower_b", "tower_c")
 
 # Where 3 is the height, and then we pass a unique name for each tower.
-# The algorithm itself can handle more discs by simply chaning the number and
-# adding additional disc names, but I don't have all of the mechanisms 
-# in place to just increase this here from a Blender perspective.
+# To use more discs, pass the number of discs to hanoi() as well, e.g. hanoi(8) and
+# move_tower(8, ...).  The discs are the objects "ring_size_1" up to "ring_size_8" stacked
+# up on tower_a; if the scene has more or fewer, fit_discs() makes them.  All of the
+# movements are worked out by tower_geometry.
 
 class hanoi:
     # This is our constructor (Well apparently it's not really a consturctor because Python has already
     # created the class), but __init__(self) has same functionality of a constructor in other 
     # Object Oriented languages in that it's called as soon as you create the object. 
-     
-    def __init__(self):
-        # Create 3 stacks to keep track of which disks are on which towers.
-        self.tower_a_stack = stack_with_hole_on_right()
-        self.tower_b_stack = stack_with_hole_on_right()
-        self.tower_c_stack = stack_with_hole_on_right()
-    
-        # Pushing our 3 rings onto the first (left-most) Stack. 
-        # The smallest ring is "ring_size_1" and the largest ring is "ring_size_3".
-        # So we push the larger ring first "ring_size_3", as it goes on to the bottom.    
-        self.tower_a_stack.push("ring_size_3")
-        self.tower_a_stack.push("ring_size_2")
-        self.tower_a_stack.push("ring_size_1")
+    #
+    # discs is how many discs are in the scene, named "ring_size_1" up to "ring_size_<discs>".
+    # geometry is a tower_geometry; the default one matches the towers in our .blend file.
+    # pegs is how many towers there are.  With more than 3, the default geometry carries on
+    # spacing them 5 units apart (tower_d at 15, tower_e at 20).
+    #
+    # start_poles is for starting part way through a puzzle: a list of the tower name each
+    # disc is sitting on, smallest disc first (see solve_moves()).  The discs in the scene
+    # have to already be sitting there.  Leave it out to start with every disc on tower_a.
+    def __init__(self, discs=3, geometry=None, frame_rate=24, pegs=3, start_poles=None):
+        import_bpy()
+
+        self.discs = discs
+        if geometry is None:
+            geometry = tower_geometry(discs, pole_x=tuple(5 * peg for peg in range(pegs)))
+        self.geometry = geometry
+
+        # Keep track of which disks are on which towers.
+        # We start with all of the rings on the first (left-most) tower, "tower_a".
+        # The smallest ring is "ring_size_1" (disc 1) and the largest ring is the last one.
+        # If the scene doesn't have the right number of discs in it, make them (see fit_discs()).
+        if start_poles is None:
+            start_poles = ["tower_a"] * discs
+            fit_discs(discs, geometry)
+        self.towers = tower_state(0, 0, pegs)
+        for disc in range(discs, 0, -1):
+            self.towers.push(pole_numbers[start_poles[disc - 1]], disc)
+        self.disc_names = [disc_name(disc) for disc in range(1, discs + 1)]
    
         # Lets define a frame rate.  That way we can increase frames by this amount, and if we decide 
         # to change the frame rate later, we only have to change it in this code in one spot.
-        self.frame_rate = 24
+        self.frame_rate = frame_rate
         
         # This will hold what frame that we are currently on.  Basically each time we have a movement,
         # we will run the code:  self.frame_count += frame_rate
         self.frame_count = 0      
 
+        # Every disc gets lifted to the same height and dropped into a slot that depends on how
+        # many discs are under it, so we need to know where the bottom slot is for each disc.
+        # Each disc starts with all of the bigger discs on its tower underneath it.
+        # bottom_z[disc] is that height for disc number "disc" (bottom_z[0] isn't used).
+        self.bottom_z = [0.0] * (discs + 1)
+        for disc in range(1, discs + 1):
+            start_z = bpy.data.objects[disc_name(disc)].location.z
+            board = self.towers.boards[self.towers.tower_of(disc)]
+            # The bigger discs on the same tower are the bits above this disc's bit.
+            self.bottom_z[disc] = start_z - geometry.slot_z[bin(board >> disc).count("1")]
+
         # Set initial keyframes:
         
         # The nice thing about this is that we are inserting keyframes on a specific object.
@@ -90,16 +1815,21 @@ class hanoi:
         # which is confusing to me as I don't know which object I was setting the keyframes on.
         # By using bpy.data.objects["name"].keyframe_insert(args). I know that the keyframes that I want to insert
         # are getting inserted on the specifc objects that I intended.
-        bpy.data.objects["ring_size_3"].keyframe_insert(data_path='location', frame=self.frame_count)
-        bpy.data.objects["ring_size_2"].keyframe_insert(data_path='location', frame=self.frame_count)
-        bpy.data.objects["ring_size_1"].keyframe_insert(data_path='location', frame=self.frame_count)
+        #
+        # These take a moment even when nobody asked for stats, so setup_seconds keeps how long
+        # they took for enable_stats() to pick up later.
+        start_time = time.perf_counter()
+        for name in reversed(self.disc_names):
+            bpy.data.objects[name].keyframe_insert(data_path='location', frame=self.frame_count)
+        text_start_time = time.perf_counter()
         
-        # The debugging here is a litte over complicated, mainly because I wasn't sure what
+        # The debugging here used to be a litte over complicated, mainly because I wasn't sure what
         # was happening originally, and I also intended to show explanations during the animation
         # (but I didn't get that far).
         #
-        # So what we do is to append the text that we want to see into a class variable called self.debug_buffer.
-        # At the end, we will take the entire buffer and display the entire text as one text object.
+        # Now move_disk() records what it does into self.trace (a move_trace), but only after
+        # enable_trace() has been called, so normal runs don't pay anything for it.  The text
+        # object is where show_trace() puts the trace so we can see it in the scene.
         bpy.ops.object.text_add(location=(10,0,10), rotation=(90,0,0))
         
         self.ob = bpy.context.object
@@ -107,8 +1837,16 @@ class hanoi:
         self.tcu = self.ob.data
         self.tcu.name = 'text_tcu_debug'
         self.tcu.body = ""
+        self.setup_seconds = {"initial_keys": text_start_time - start_time,
+                              "text_setup": time.perf_counter() - text_start_time}
         
-        self.debug_buffer = ""
+        self.trace = None
+
+        # A build_stats, once enable_stats() has been called.
+        self.stats = None
+
+        # The move_captions from show_captions(), if it has been called.
+        self.captions = None
         
         # The self.iter_count was used to stop the animation at certain points for debugging.
         # Beyond that it's not used anywhere else.  I already commented it out, but I had a 
@@ -116,44 +1854,178 @@ class hanoi:
         # routine early if it hit a certain number.
         self.iter_count = 0
 
-    # This is the actual recursive Tower of Hanoi algorithm.  
+        # How many seconds the last move_tower() or move_tower_bulk() call took.
+        self.build_seconds = 0
+
+        # Set this to a plan_cache to have move_tower_bulk() save and reuse its plans.
+        self.plan_cache = None
+
+    # Starts recording the last "capacity" steps that move_disk() does into self.trace.
+    def enable_trace(self, capacity=1024):
+        self.trace = move_trace(capacity)
+
+    def disable_trace(self):
+        self.trace = None
+
+    # Puts the recorded trace into our text_object_debug text object.
+    def show_trace(self):
+        if self.trace is not None:
+            self.tcu.body = self.trace.text()
+
+    # Starts counting and timing everything the animation build does in self.stats (see
+    # build_stats), starting with the initial keyframes and text object from hanoi().
+    def enable_stats(self):
+        self.stats = build_stats()
+        self.stats.active_keyframes += self.discs
+        self.stats.bpy_calls += 2 * self.discs + 1
+        for phase, seconds in self.setup_seconds.items():
+            self.stats.add_time(phase, seconds)
+
+    def disable_stats(self):
+        self.stats = None
+
+    # Shows a caption for each move in our text object while the animation plays (see
+    # move_captions), instead of the trace.  moves should be the same ones the animation
+    # was built from, e.g. hanoi_moves(3, "tower_a", "tower_b", "tower_c").
+    def show_captions(self, moves):
+        if self.captions is not None:
+            self.captions.remove()
+        self.captions = move_captions(moves, self.frame_rate)
+        self.captions.install(self.tcu)
+
+    # This used to be the actual recursive Tower of Hanoi algorithm.
     # See here for explanation:  http://interactivepython.org/runestone/static/pythonds/Recursion/TowerofHanoi.html
+    #
+    # It now walks the moves from hanoi_moves() above, which produces the exact same
+    # sequence of moves as the recursion, just one at a time and without recursing.
     def move_tower(self, height, from_pole, to_pole, with_pole):
-        if height >= 1:
-            self.iter_count += 1   
-            
-            self.move_tower(height-1, from_pole, with_pole, to_pole)
-            self.move_disk(from_pole, to_pole)
-            self.move_tower(height-1, with_pole, to_pole, from_pole)
+        self.play_moves(hanoi_moves(height, from_pole, to_pole, with_pole))
+
+    # Animates every (disc, from_pole, to_pole) move from "moves" with move_disk().  This is what
+    # move_tower(), solve_to() and move_tower_multi() all do with their moves.
+    def play_moves(self, moves):
+        start_time = time.perf_counter()
+
+        stats = self.stats
+        if stats is None:
+            for disc, source_pole, destination_pole in moves:
+                self.iter_count += 1
+
+                self.move_disk(source_pole, destination_pole)
+        else:
+            # The same, but timing how long each move takes to come out of "moves".
+            solve_start_time = time.perf_counter()
+            for disc, source_pole, destination_pole in moves:
+                stats.add_time("solve", time.perf_counter() - solve_start_time)
+                self.iter_count += 1
+
+                self.move_disk(source_pole, destination_pole)
+                solve_start_time = time.perf_counter()
+
+        self.build_seconds = time.perf_counter() - start_time
+
+    # Moves every disc on to to_pole from wherever they are now, in as few moves as possible
+    # (see solve_moves()).  This works from any position, like after a hanoi(start_poles=...)
+    # or part way through building an animation.  Only for 3 towers.
+    def solve_to(self, to_pole):
+        pole_names = ["tower_a", "tower_b", "tower_c"]
+        disc_poles = [pole_names[self.towers.tower_of(disc)] for disc in range(1, self.discs + 1)]
+        self.play_moves(solve_moves(disc_poles, to_pole, pole_names))
+
+    # This is move_tower_bulk() squeezed into at most frame_budget frames, for heights that
+    # would take far too long to render otherwise (see plan_compressed_keyframes()).
+    def move_tower_compressed(self, height, from_pole, to_pole, with_pole, frame_budget):
+        start_time = time.perf_counter()
+
+        start_locations = {}
+        for disc in range(1, height + 1):
+            location = bpy.data.objects[disc_name(disc)].location
+            start_locations[disc_name(disc)] = (location.x, location.y, location.z)
+
+        tracks, frame_end = plan_compressed_keyframes(height, frame_budget, start_locations, from_pole, to_pole,
+                                                      with_pole, self.frame_rate, self.geometry)
+        plan_done_time = time.perf_counter()
+        write_keyframes_bulk(tracks)
+        if self.stats is not None:
+            self.count_bulk_stats(tracks, (1 << height) - 1, start_time, plan_done_time)
+
+        self.iter_count += (1 << height) - 1
+        self.frame_count += frame_end
+        self.towers.move_top(pole_numbers[from_pole], pole_numbers[to_pole], height)
+
+        self.build_seconds = time.perf_counter() - start_time
+
+    # This is move_tower() for 4 or more towers.  spare_poles is a list of the names of all
+    # of the other towers, e.g. move_tower_multi(8, "tower_a", "tower_b", ["tower_c", "tower_d"]).
+    # The moves come from frame_stewart_moves(), and get animated by move_disk() the same
+    # way as with 3 towers.
+    def move_tower_multi(self, height, from_pole, to_pole, spare_poles):
+        self.play_moves(frame_stewart_moves(height, from_pole, to_pole, spare_poles))
+
+    # This builds the exact same animation as move_tower(), but using plan_dense_keyframes()
+    # and write_keyframes_bulk() instead of calling keyframe_insert() over and over.
+    # It only supports moving the whole tower, since the plan starts from frame 0.
+    #
+    # With sparse=True it uses plan_sparse_keyframes() instead, so only the moving disc
+    # gets keyframes.  The animation looks the same but has far fewer keyframes in it.
+    #
+    # If self.plan_cache is set to a plan_cache, the plan is loaded from there when we've
+    # built the same animation before.
+    def move_tower_bulk(self, height, from_pole, to_pole, with_pole, sparse=False):
+        start_time = time.perf_counter()
+
+        start_locations = {}
+        for disc in range(1, height + 1):
+            location = bpy.data.objects[disc_name(disc)].location
+            start_locations[disc_name(disc)] = (location.x, location.y, location.z)
+
+        tracks = plan_keyframes(height, self.frame_rate, start_locations, from_pole, to_pole, with_pole,
+                                sparse, self.geometry, self.plan_cache)
+        plan_done_time = time.perf_counter()
+        write_keyframes_bulk(tracks)
+        if self.stats is not None:
+            self.count_bulk_stats(tracks, (1 << height) - 1, start_time, plan_done_time)
+
+        # Keep our towers and frame count in step with what move_tower() would have left behind.
+        moves = (1 << height) - 1
+        self.iter_count += moves
+        self.frame_count += 3 * self.frame_rate * moves
+        self.towers.move_top(pole_numbers[from_pole], pole_numbers[to_pole], height)
+
+        self.build_seconds = time.perf_counter() - start_time
             
+    # Adds a bulk build to self.stats: the plan phase ran from start_time to plan_done_time and
+    # the write phase from then until now.  write_keyframes_bulk() makes 16 calls into Blender
+    # per track (not counting removing any old F-curves).
+    def count_bulk_stats(self, tracks, moves, start_time, plan_done_time):
+        stats = self.stats
+        stats.add_time("plan", plan_done_time - start_time)
+        stats.add_time("write", time.perf_counter() - plan_done_time)
+        stats.moves += moves
+        stats.bulk_keyframes += sum(track.size() for track in tracks)
+        stats.bpy_calls += 16 * len(tracks)
+
     # The tricky thing about keyframes is that you have consider all of your objects that have motion
     # at all points in time.  So it's not just moving 1 disc in this case. 
     # Even though only 1 disc moves at a time, we have to consider the other discs that are just sitting there,
     # otherwise they will start moving prematurely.       
     
     # So basically what we do is once we move a disc, we pass that name into this function.
-    # Then it looks at the other 2 discs and inserts a keyframe for them as well at the passed in frame.
-    # That way the other 2 discs will stay put while another disc is being moved.   
+    # Then it looks at the other discs and inserts a keyframe for them as well at the passed in frame.
+    # That way the other discs will stay put while another disc is being moved.   
     def keep_other_discs_at_rest(self, disc_to_not_keep_at_rest, frame_to_insert_keyframe):
-         if disc_to_not_keep_at_rest == "ring_size_1":
-             bpy.data.objects["ring_size_2"].keyframe_insert(data_path='location', frame=frame_to_insert_keyframe)
-             bpy.data.objects["ring_size_3"].keyframe_insert(data_path='location', frame=frame_to_insert_keyframe)
-             
-         elif disc_to_not_keep_at_rest == "ring_size_2":
-             bpy.data.objects["ring_size_1"].keyframe_insert(data_path='location', frame=frame_to_insert_keyframe)
-             bpy.data.objects["ring_size_3"].keyframe_insert(data_path='location', frame=frame_to_insert_keyframe)
-             
-         elif disc_to_not_keep_at_rest == "ring_size_3":
-             bpy.data.objects["ring_size_1"].keyframe_insert(data_path='location', frame=frame_to_insert_keyframe)
-             bpy.data.objects["ring_size_2"].keyframe_insert(data_path='location', frame=frame_to_insert_keyframe)        
-    
-    
-    # The move_disk() function is over complicated and could be simplified, but I didn't get that far.
-    # But it still worked as is.
-    
-    # Basically there are 3 if/elif conditions, one if our source tower is "tower_a", "tower_b" and "tower_c".
-    # I'm only going to describe one block, as they essentially all have the same logic, it's just a matter of 
-    # what our source tower is and what our destination tower is.
+        stats = self.stats
+        if stats is not None:
+            start_time = time.perf_counter()
+
+        for name in self.disc_names:
+            if name != disc_to_not_keep_at_rest:
+                bpy.data.objects[name].keyframe_insert(data_path='location', frame=frame_to_insert_keyframe)
+
+        if stats is not None:
+            stats.add_time("hold", time.perf_counter() - start_time)
+            stats.hold_keyframes += len(self.disc_names) - 1
+            stats.bpy_calls += 2 * (len(self.disc_names) - 1)
     
     # How the movement is scaled:
     # Moving a disk is a 3 step process:
@@ -161,345 +2033,250 @@ class hanoi:
     #  2.  Move the disk left or right on x axis
     #  3.  Move the disk down the z axis
     
-    # My goal was to use integer blender units, but due to the complexity of this,
-    # I didn't quite fully get it scaled that way.  
-    # So for z axis movement, I got it down to 0.5 increments, which is still easy enough to work with.
-    # For x axis, I did get it down to just integers.
-    
-    # So for the z axis movements, we will move up or down by either 6, 6.5, or 7 Blender units.
-    # Basically the discs will move up to the same height.  So it the disc is on the bottom,
-    # it will move up 7 units.  If there are 2 discs, it will move up 6.5, and if there are 3 discs,
-    # the disc being moved will move up 6 units.
-    
-    # For the x axis movements, we will either move 5 Blender units to the left or right to move 
-    # one tower over, or 10 Blender units if moving two towers over.
+    # The distances all come from self.geometry (see tower_geometry above):
+    #   - Going up, every disc is lifted to the same height (geometry.lift above its bottom slot),
+    #     no matter how many discs were under it.
+    #   - Going across, we move by the difference between the two towers' spots in geometry.pole_x.
+    #   - Coming down, the disc drops into the slot on top of the discs already on the destination
+    #     tower, which is geometry.slot_z[number of discs on that tower] above the bottom slot.
+    #
+    # This used to be 3 big if/elif blocks (one per source tower, each with one branch per
+    # destination tower and per stack size), which only worked for 3 discs.  Since every
+    # combination follows the same rule, it's now just a few lookups.
     
-    # The rest of the comments for this block are written above each apprioate line.
-    # I only did this for one of the blocks as the same logic applies to the other 
-    # 2 code blocks as well. 
-    
-################################################################################            
+    # Key frames are tricky.  Here is the process for each of the 3 steps:
+    # Assume you already have previous keyframes set (which we did in hanoi.__init__(self):
+    #   1.  Change the frame count to the new frame.  In this case we are always bumping up by 24 frames 
+    #       (aka self.frame_rate).
+    #   2.  Move our object.
+    #   3.  Set our new key frames.  This involes:
+    #       1.  Setting our keyframe on the object in question.
+    #       2.  Calling self.keep_other_discs_at_rest() for the other discs.
     def move_disk(self, from_pole, to_pole):
+        geometry = self.geometry
+        source = pole_numbers[from_pole]
+        destination = pole_numbers[to_pole]
 
-        # So we see which tower is our source tower and which tower is our destination.
-        self.debug_buffer = "\n\nFrom pole: " + from_pole + "\n" + "To pole:     " + to_pole + "\n"   
+        # Getting the height of the destination tower to determine how far down to drop the disc,
+        # and then moving the top disc from one tower to the other in our tower_state.
+        length_of_destination_stack = self.towers.height(destination)
+        disc = self.towers.move(source, destination)
 
-        if from_pole == "tower_a":
-            length_of_tower_a_stack = self.tower_a_stack.size()  # Getting the length of the stack to determine how many
-                                                                 # Blender units to move up/down.
-            top_disc_on_tower_a = self.tower_a_stack.peek()  # Peeks looks at the top entry but doesn't remove it.
-            
-            self.debug_buffer += "The length of tower_a_stack is: " + str(length_of_tower_a_stack) + "\n"
-            self.debug_buffer += "Peeking top disc on tower a is: " + top_disc_on_tower_a + "\n"
-            
-            # Key frames are tricky.  Here is the process:
-            # Assume you already have previous keyframes set (which we did in hanoi.__init__(self):
-            #   1.  Change the frame count to the new frame.  In this case we are always bumping up by 24 frames 
-            #       (aka self.frame_rate).
-            #   2.  Move our object.  In this case, the length that we move up the z axis is determined by the
-            #       spot that the disc in question is on.
-            #   3.  Set our new key frames.  This involes:
-            #       1.  Setting our keyframe on the object in question.
-            #       2.  Calling self.keep_other_discs_at_rest() for the other discs.
-            
-           
-            # BEGIN: This block is for moving the disc up the z axis:
-            
-            self.frame_count += self.frame_rate            
-            if length_of_tower_a_stack == 3:  
-                bpy.data.objects[top_disc_on_tower_a].location.z += 6
-                self.debug_buffer += "I see 3 discs on source tower a so I move up z axis by 6.\n"
-                    
-            elif length_of_tower_a_stack == 2:
-                bpy.data.objects[top_disc_on_tower_a].location.z += 6.5
-                self.debug_buffer += "I see 2 discs on source tower a so I move up z axis by 6.5.\n"    
-                    
-            elif length_of_tower_a_stack == 1:
-                bpy.data.objects[top_disc_on_tower_a].location.z += 7
-                self.debug_buffer += "I see 1 discs on source tower a so I move up z axis by 7.\n"
-    
-            bpy.data.objects[top_disc_on_tower_a].keyframe_insert(data_path='location', frame=self.frame_count)
-            self.keep_other_discs_at_rest(top_disc_on_tower_a, self.frame_count - self.frame_rate)
-            
-            
-            self.debug_buffer += "KFD: I inserted a key frame on: " + top_disc_on_tower_a + " at frame: " + str(self.frame_count) + "\n"
-            self.debug_buffer += "KFD: I inserted a key frame on the other 2 discs at frame: " + str(self.frame_count - self.frame_rate) + "\n"
-    
-            # END: This block is for moving the disc up the z axis:
-    
-            # BEGIN: This block is for moving the disc across the x axis:
-            if to_pole == "tower_b":
-                length_of_tower_b_stack = self.tower_b_stack.size()
-                self.debug_buffer += "The length of tower_b_stack is: " + str(length_of_tower_b_stack) + "\n"
-                
-                self.frame_count += self.frame_rate  
-                bpy.data.objects[top_disc_on_tower_a].location.x += 5
-                bpy.data.objects[top_disc_on_tower_a].keyframe_insert(data_path='location', frame=self.frame_count)
-                self.keep_other_discs_at_rest(top_disc_on_tower_a, self.frame_count - self.frame_rate) 
-                
-                self.debug_buffer += "KFD: I inserted a key frame on: " + top_disc_on_tower_a + " at frame: " + str(self.frame_count) + "\n"
-                self.debug_buffer += "KFD: I inserted a key frame on the other 2 discs at frame: " + str(self.frame_count - self.frame_rate) + "\n"                              
-                
-                # Now that we have actually removed the disc from the tower, let's pop it off the stack,
-                # and save it temporarily in the "poppsed_disc" variable, as we will need to push it back
-                # on to a new stack soon.
-                popped_disc = self.tower_a_stack.pop()
-
-                self.debug_buffer += "I am moving: " + top_disc_on_tower_a + " to the right on the x axis by 5.\n"
-                
-                # END: This block is for moving the disc across the x axis:
-                
-                # BEGIN: This block is for moving the disc down the z axis:
-                self.frame_count += self.frame_rate 
-                
-                if length_of_tower_b_stack == 0:
-                    bpy.data.objects[popped_disc].location.z -= 7
-                    self.debug_buffer += "I am moving: " + popped_disc + " down by 7 on the z axis.\n"
-                    
-                elif length_of_tower_b_stack == 1:
-                    bpy.data.objects[popped_disc].location.z -= 6.5
-                    self.debug_buffer += "I am moving: " + popped_disc + " down by 6.5 on the z axis.\n"
-                    
-                elif length_of_tower_b_stack == 2:
-                    bpy.data.objects[popped_disc].location.z -= 6                
-                    self.debug_buffer += "I am moving: " + popped_disc + " down by 6 on the z axis.\n"
-                  
-                # One thing to note here, I have to called self.keep_other_discs_at_rest() twice here,
-                # once for the normal run, and another time one second beforehand.  Otherwise
-                # certain keyframes were getting missed and then discs were moving prematurely.  
-                bpy.data.objects[popped_disc].keyframe_insert(data_path='location', frame=self.frame_count) 
-                self.keep_other_discs_at_rest(popped_disc, self.frame_count - self.frame_rate)
-                self.keep_other_discs_at_rest(popped_disc, self.frame_count)
-                
-                
-                self.debug_buffer += "KFD: I inserted a key frame on: " + popped_disc + " at frame: " + str(self.frame_count) + "\n"
-                self.debug_buffer += "KFD: I inserted a key frame on the other 2 discs at position: " + str(self.frame_count - self.frame_rate) + "\n"                
-                    
-                # Now we push our previously popped off disc and push it on to the new destination stack.     
-                self.tower_b_stack.push(popped_disc)    
-
-            elif to_pole == "tower_c":                    
-                length_of_tower_c_stack = self.tower_c_stack.size()
-                self.debug_buffer += "The length of tower_c_stack is: " + str(length_of_tower_c_stack) + "\n"
-
-                self.frame_count += self.frame_rate  
-                bpy.data.objects[top_disc_on_tower_a].location.x += 10
-                bpy.data.objects[top_disc_on_tower_a].keyframe_insert(data_path='location', frame=self.frame_count)
-                self.keep_other_discs_at_rest(top_disc_on_tower_a, self.frame_count - self.frame_rate) 
-                
-                self.debug_buffer += "KFD: I inserted a key frame on: " + top_disc_on_tower_a + " at frame: " + str(self.frame_count) + "\n"
-                self.debug_buffer += "KFD: I inserted a key frame on the other 2 discs at position: " + str(self.frame_count - self.frame_rate) + "\n"                
-                                
-                popped_disc = self.tower_a_stack.pop() 
-                
-                self.debug_buffer += "I am moving: " + top_disc_on_tower_a + " to the right on the x axis by 10.\n"   
-
-                self.frame_count += self.frame_rate
-
-                if length_of_tower_c_stack == 0:
-                    bpy.data.objects[popped_disc].location.z -= 7
-                    self.debug_buffer += "I am moving: " + popped_disc + " down by 7 on the z axis.\n"
-                    
-                elif length_of_tower_c_stack == 1:
-                    bpy.data.objects[popped_disc].location.z -= 6.5
-                    self.debug_buffer += "I am moving: " + popped_disc + " down by 6.5 on the z axis.\n"
-                    
-                elif length_of_tower_c_stack == 2:
-                    bpy.data.objects[popped_disc].location.z -= 6
-                    self.debug_buffer += "I am moving: " + popped_disc + " down by 6 on the z axis.\n"
-                
-                bpy.data.objects[popped_disc].keyframe_insert(data_path='location', frame=self.frame_count)
-                self.keep_other_discs_at_rest(popped_disc, self.frame_count - self.frame_rate)
-                self.keep_other_discs_at_rest(popped_disc, self.frame_count)
-
-                self.debug_buffer += "KFD: I inserted a key frame on: " + popped_disc + " at frame: " + str(self.frame_count) + "\n"
-                self.debug_buffer += "KFD: I inserted a key frame on the other 2 discs at frame: " + str(self.frame_count - self.frame_rate) + "\n"
-                    
-                self.tower_c_stack.push(popped_disc) 
-                  
-
-################################################################################
-            
-################################################################################                        
-        elif from_pole == "tower_b":
-            length_of_tower_b_stack = self.tower_b_stack.size()
-            top_disc_on_tower_b = self.tower_b_stack.peek()
-            
-            self.debug_buffer += "The length of tower_b_stack is: " + str(length_of_tower_b_stack) + "\n"
-            self.debug_buffer += "Peeking top disc on tower b is: " + top_disc_on_tower_b + "\n"
-            
-            self.frame_count += self.frame_rate
-            
-            if length_of_tower_b_stack == 3:     
-                bpy.data.objects[top_disc_on_tower_b].location.z += 6
-                self.debug_buffer += "I see 3 discs on source tower b so I move up z axis by 6.\n"
-                    
-            elif length_of_tower_b_stack == 2:
-                bpy.data.objects[top_disc_on_tower_b].location.z += 6.5
-                self.debug_buffer += "I see 2 discs on source tower b so I move up z axis by 6.5.\n"
-                    
-            elif length_of_tower_b_stack == 1:
-                bpy.data.objects[top_disc_on_tower_b].location.z += 7
-                self.debug_buffer += "I see 1 discs on source tower b so I move up z axis by 7.\n"             
-            
-            bpy.data.objects[top_disc_on_tower_b].keyframe_insert(data_path='location', frame=self.frame_count)
-            self.keep_other_discs_at_rest(top_disc_on_tower_b, self.frame_count - self.frame_rate)
-            
-            
-          
-            if to_pole == "tower_a":
-                length_of_tower_a_stack = self.tower_a_stack.size()
-                self.debug_buffer += "The length of tower_a_stack is: " + str(length_of_tower_a_stack) + "\n"
-                
-                self.frame_count += self.frame_rate
-                bpy.data.objects[top_disc_on_tower_b].location.x -= 5
-                bpy.data.objects[top_disc_on_tower_b].keyframe_insert(data_path='location', frame=self.frame_count)
-                self.keep_other_discs_at_rest(top_disc_on_tower_b, self.frame_count - self.frame_rate)
-
-                popped_disc = self.tower_b_stack.pop()                 
-                
-                self.debug_buffer += "I am moving: " + top_disc_on_towerb + " to the left on the x axis by 5.\n"
-                
-                self.frame_count += self.frame_rate
-                if length_of_tower_a_stack == 0:
-                    bpy.data.objects[popped_disc].location.z -= 7
-                    self.debug_buffer += "I am moving: " + popped_disc + " down by 7 on the z axis.\n"
-                    
-                elif length_of_tower_a_stack == 1:
-                    bpy.data.objects[popped_disc].location.z -= 6.5
-                    self.debug_buffer += "I am moving: " + popped_disc + " down by 6.5 on the z axis.\n"
-                    
-                elif length_of_tower_a_stack == 2:
-                    bpy.data.objects[popped_disc].location.z -= 6
-                    self.debug_buffer += "I am moving: " + popped_disc + " down by 6 on the z axis.\n"
-                
-                bpy.data.objects[popped_disc].keyframe_insert(data_path='location', frame=self.frame_count)
-                self.keep_other_discs_at_rest(popped_disc, self.frame_count - self.frame_rate)
-                self.keep_other_discs_at_rest(popped_disc, self.frame_count)
-                    
-                self.tower_a_stack.push(popped_disc)                                      
-
-            elif to_pole == "tower_c":                    
-                length_of_tower_c_stack = self.tower_c_stack.size()
-                self.debug_buffer += "The length of tower_c_stack is: " + str(length_of_tower_c_stack) + "\n"
-
-                self.frame_count += self.frame_rate
-                bpy.data.objects[top_disc_on_tower_b].location.x += 5
-                bpy.data.objects[top_disc_on_tower_b].keyframe_insert(data_path='location', frame=self.frame_count)
-                self.keep_other_discs_at_rest(top_disc_on_tower_b, self.frame_count - self.frame_rate)
-                
-                popped_disc = self.tower_b_stack.pop()                     
-                
-                self.debug_buffer += "I am moving: " + top_disc_on_tower_b + " to the right on the x axis by 5.\n" 
-
-                self.frame_count += self.frame_rate
-                if length_of_tower_c_stack == 0:
-                    bpy.data.objects[popped_disc].location.z -= 7
-                    self.debug_buffer += "I am moving: " + popped_disc + " down by 7 on the z axis.\n"
-                    
-                elif length_of_tower_c_stack == 1:
-                    bpy.data.objects[popped_disc].location.z -= 6.5        
-                    self.debug_buffer += "I am moving: " + popped_disc + " down by 6.5 on the z axis.\n"
-                    
-                elif length_of_tower_c_stack == 2:
-                    bpy.data.objects[popped_disc].location.z -= 6     
-                    self.debug_buffer += "I am moving: " + popped_disc + " down by 6 on the z axis.\n" 
-                 
-                bpy.data.objects[popped_disc].keyframe_insert(data_path='location', frame=self.frame_count)
-                self.keep_other_discs_at_rest(popped_disc, self.frame_count - self.frame_rate)
-                self.keep_other_discs_at_rest(popped_disc, self.frame_count)
-                                    
-                self.tower_c_stack.push(popped_disc)    
-
-################################################################################  
-
-################################################################################ 
-        elif from_pole == "tower_c":
-            length_of_tower_c_stack = self.tower_c_stack.size()
-            top_disc_on_tower_c = self.tower_c_stack.peek()
-
-            self.debug_buffer += "The length of tower_c_stack is: " + str(length_of_tower_c_stack) + "\n"
-            self.debug_buffer += "Peeking top disc on tower c is: " + top_disc_on_tower_c + "\n"
-            
-            self.frame_count += self.frame_rate
-            if length_of_tower_c_stack == 3:     
-                bpy.data.objects[top_disc_on_tower_c].location.z += 6
-                self.debug_buffer += "I see 3 discs on source tower c so I move up z axis by 6.\n"
-                    
-            elif length_of_tower_c_stack == 2:
-                bpy.data.objects[top_disc_on_tower_c].location.z += 6.5
-                self.debug_buffer += "I see 2 discs on source tower c so I move up z axis by 6.5.\n"
-                    
-            elif length_of_tower_c_stack == 1:
-                bpy.data.objects[top_disc_on_tower_c].location.z += 7
-                self.debug_buffer += "I see 1 discs on source tower c so I move up z axis by 7.\n"
-            
-            bpy.data.objects[top_disc_on_tower_c].keyframe_insert(data_path='location', frame=self.frame_count)
-            
-            if to_pole == "tower_a":
-                length_of_tower_a_stack = self.tower_a_stack.size()
-                self.debug_buffer += "The length of tower_a_stack is: " + str(length_of_tower_a_stack) + "\n"
-                
-                self.frame_count += self.frame_rate
-                bpy.data.objects[top_disc_on_tower_c].location.x -= 10
-                bpy.data.objects[top_disc_on_tower_c].keyframe_insert(data_path='location', frame=self.frame_count)
-                self.keep_other_discs_at_rest(top_disc_on_tower_c, self.frame_count - self.frame_rate)  
-
-                popped_disc = self.tower_c_stack.pop()                 
-                
-                self.frame_count += self.frame_rate
-                if length_of_tower_a_stack == 0:
-                    bpy.data.objects[popped_disc].location.z -= 7
-                    self.debug_buffer += "I am moving: " + popped_disc + " down by 7 on the z axis.\n"
-                    
-                elif length_of_tower_a_stack == 1:
-                    bpy.data.objects[popped_disc].location.z -= 6.5
-                    self.debug_buffer += "I am moving: " + popped_disc + " down by 6.5 on the z axis.\n"
-                    
-                elif length_of_tower_a_stack == 2:
-                    bpy.data.objects[popped_disc].location.z -= 6
-                    self.debug_buffer += "I am moving: " + popped_disc + " down by 6 on the z axis.\n"
-                
-                bpy.data.objects[popped_disc].keyframe_insert(data_path='location', frame=self.frame_count)
-                self.keep_other_discs_at_rest(popped_disc, self.frame_count - self.frame_rate)
-                self.keep_other_discs_at_rest(popped_disc, self.frame_count)
-                    
-                self.tower_a_stack.push(popped_disc) 
-
-            elif to_pole == "tower_b":                    
-                length_of_tower_b_stack = self.tower_b_stack.size()
-                self.debug_buffer += "The length of tower_b_stack is: " + str(length_of_tower_b_stack) + "\n"
-
-                self.frame_count += self.frame_rate
-                bpy.data.objects[top_disc_on_tower_c].location.x -= 5
-                bpy.data.objects[top_disc_on_tower_c].keyframe_insert(data_path='location', frame=self.frame_count)
-                self.keep_other_discs_at_rest(top_disc_on_tower_c, self.frame_count - self.frame_rate)                 
-                
-                popped_disc = self.tower_c_stack.pop()               
-
-                self.frame_count += self.frame_rate
-                if length_of_tower_b_stack == 0:
-                    bpy.data.objects[popped_disc].location.z -= 7
-                    self.debug_buffer += "I am moving: " + popped_disc + " down by 7 on the z axis.\n"
-                    
-                elif length_of_tower_b_stack == 1:
-                    bpy.data.objects[popped_disc].location.z -= 6.5
-                    self.debug_buffer += "I am moving: " + popped_disc + " down by 6.5 on the z axis.\n"
-                    
-                elif length_of_tower_b_stack == 2:
-                    bpy.data.objects[popped_disc].location.z -= 6
-                    self.debug_buffer += "I am moving: " + popped_disc + " down by 6 on the z axis.\n"
-               
-                bpy.data.objects[popped_disc].keyframe_insert(data_path='location', frame=self.frame_count)
-                self.keep_other_discs_at_rest(popped_disc, self.frame_count - self.frame_rate)
-                self.keep_other_discs_at_rest(popped_disc, self.frame_count)
-                    
-                self.tower_b_stack.push(popped_disc)    
-                                
-                   
-################################################################################ 
-
-# And now we create our hanoi object, and then call move_tower() with a height of 3
-# and the names of the towers (any name will work as long as they are unique).
-hanoi_object = hanoi()
-hanoi_object.move_tower (3, "tower_a", "tower_b", "tower_c")
+        name = disc_name(disc)
+        disc_object = bpy.data.objects[name]
+        location = disc_object.location
+        bottom_z = self.bottom_z[disc]
+        trace = self.trace
+        stats = self.stats
+        if stats is not None:
+            # The object lookup and the 3 keyframe_insert() calls below.
+            stats.moves += 1
+            stats.active_keyframes += 3
+            stats.bpy_calls += 4
+            phase_start_time = time.perf_counter()
+
+        # BEGIN: This block is for moving the disc up the z axis:
+        self.frame_count += self.frame_rate
+        if trace is not None:
+            trace.record(self.iter_count, disc, 0, self.frame_count, bottom_z + geometry.lift - location.z)
+        location.z = bottom_z + geometry.lift
+        disc_object.keyframe_insert(data_path='location', frame=self.frame_count)
+        self.keep_other_discs_at_rest(name, self.frame_count - self.frame_rate)
+        if stats is not None:
+            phase_start_time = stats.end_phase("lift", phase_start_time)
+        # END: This block is for moving the disc up the z axis:
+
+        # BEGIN: This block is for moving the disc across the x axis:
+        self.frame_count += self.frame_rate
+        across = geometry.pole_x[destination] - geometry.pole_x[source]
+        if trace is not None:
+            trace.record(self.iter_count, disc, 1, self.frame_count, across)
+        location.x += across
+        disc_object.keyframe_insert(data_path='location', frame=self.frame_count)
+        self.keep_other_discs_at_rest(name, self.frame_count - self.frame_rate)
+        if stats is not None:
+            phase_start_time = stats.end_phase("traverse", phase_start_time)
+        # END: This block is for moving the disc across the x axis:
+
+        # BEGIN: This block is for moving the disc down the z axis:
+        self.frame_count += self.frame_rate
+        if trace is not None:
+            trace.record(self.iter_count, disc, 2, self.frame_count,
+                         bottom_z + geometry.slot_z[length_of_destination_stack] - location.z)
+        location.z = bottom_z + geometry.slot_z[length_of_destination_stack]
+
+        # One thing to note here, I have to called self.keep_other_discs_at_rest() twice here,
+        # once for the normal run, and another time one second beforehand.  Otherwise
+        # certain keyframes were getting missed and then discs were moving prematurely.  
+        disc_object.keyframe_insert(data_path='location', frame=self.frame_count)
+        self.keep_other_discs_at_rest(name, self.frame_count - self.frame_rate)
+        self.keep_other_discs_at_rest(name, self.frame_count)
+        if stats is not None:
+            stats.end_phase("drop", phase_start_time)
+        # END: This block is for moving the disc down the z axis:
+
+# This is what each worker started by render_chunks.py runs.  It keys just the part of the
+# animation between frame_start and frame_end and renders those frames to output_path.
+# The output has to be a movie format (set in the .blend file), since render_chunks.py joins
+# one file per chunk back together.
+#
+# The discs are put back on frame 0 first so that we read their starting locations
+# even if the .blend file was saved with the animation already in it.  If the scene doesn't
+# have the right number of discs in it, they get made first, the same as in hanoi() (see
+# fit_discs()).
+def render_chunk(height, frame_rate, frame_start, frame_end, output_path):
+    import_bpy()
+    scene = bpy.context.scene
+    if not scene.render.is_movie_format:
+        raise ValueError("render_chunk() needs a movie output format, not " + scene.render.image_settings.file_format)
+    scene.frame_set(0)
+    fit_discs(height)
+
+    start_locations = {}
+    for disc in range(1, height + 1):
+        location = bpy.data.objects[disc_name(disc)].location
+        start_locations[disc_name(disc)] = (location.x, location.y, location.z)
+
+    tracks = plan_sparse_keyframes(height, frame_rate, start_locations, "tower_a", "tower_b", "tower_c",
+                                   frame_start, frame_end)
+    write_keyframes_bulk(tracks)
+
+    scene.frame_start = frame_start
+    scene.frame_end = frame_end
+    scene.render.filepath = output_path
+    bpy.ops.render.render(animation=True)
+
+# Returns what is wrong with asking build_animation() (and main()) for this combination, or
+# None if it can be done.  main() and batch_hanoi.py both check with this first, since
+# build_animation() would otherwise quietly leave some of it out.
+def animation_options_problem(pegs=3, backend="per_move", frame_budget=None, captions=False, check=False,
+                              cache=None):
+    if pegs != 3 and backend != "per_move":
+        return "pegs " + str(pegs) + " only works with the per_move backend"
+    if frame_budget is not None and (pegs != 3 or captions or check):
+        return "frame budget doesn't work with pegs, captions or check"
+    if frame_budget is not None and backend != "per_move":
+        return "frame budget doesn't work with the " + backend + " backend"
+    if cache and backend not in ("dense", "sparse"):
+        return "cache only works with the dense and sparse backends"
+    return None
+
+# Moves a whole tower of "height" discs from tower_a to tower_b with hanoi_object, the way
+# main() is asked to (and batch_hanoi.py, once per job):
+#   backend:      "per_move" for move_tower(), "dense" or "sparse" for move_tower_bulk().
+#   pegs:         with 4 or 5 towers it uses move_tower_multi() whatever the backend is.
+#   frame_budget: if given it uses move_tower_compressed() instead.
+#   cache:        a folder for a plan_cache, for the dense and sparse backends.
+all_pole_names = ["tower_a", "tower_b", "tower_c", "tower_d", "tower_e"]
+
+def build_animation(hanoi_object, height, backend="per_move", pegs=3, frame_budget=None, cache=None):
+    pole_names = all_pole_names[:pegs]
+    if frame_budget is not None:
+        hanoi_object.move_tower_compressed(height, "tower_a", "tower_b", "tower_c", frame_budget)
+    elif pegs != 3:
+        hanoi_object.move_tower_multi(height, pole_names[0], pole_names[1], pole_names[2:])
+    elif backend == "per_move":
+        hanoi_object.move_tower(height, "tower_a", "tower_b", "tower_c")
+    else:
+        if cache:
+            hanoi_object.plan_cache = plan_cache(cache)
+        hanoi_object.move_tower_bulk(height, "tower_a", "tower_b", "tower_c", sparse=(backend == "sparse"))
+
+# This is what runs when the script is run from Blender, either from the Text Editor or like this:
+#   blender --background tower_of_hanoi.blend --python tower_of_hanoi.py -- --height 3 --output //toh.avi
+# Blender leaves everything after the "--" alone, so that's where our own arguments are.
+# With no arguments it does what this script always did: animate 3 discs with move_tower().
+#
+# render_chunks.py also runs us this way, with --frame-start and --frame-end, to render
+# just one chunk of the animation (see render_chunk() above).
+def main(arguments=None):
+    import argparse
+
+    if arguments is None:
+        if "--" in sys.argv:
+            arguments = sys.argv[sys.argv.index("--") + 1:]
+        else:
+            arguments = []
+
+    parser = argparse.ArgumentParser(prog="tower_of_hanoi.py")
+    parser.add_argument("--height", type=int, default=3, help="how many discs to move (default 3)")
+    parser.add_argument("--frame-rate", type=int, default=24, help="frames per step of each move (default 24)")
+    parser.add_argument("--pegs", type=int, choices=(3, 4, 5), default=3,
+                        help="how many towers to use (default 3; 4 and 5 only work with the per_move backend)")
+    parser.add_argument("--backend", choices=("per_move", "dense", "sparse"),
+                        help="per_move (the default) uses move_tower(), dense and sparse use move_tower_bulk()")
+    parser.add_argument("--cache", help="folder to keep a plan_cache in, for the dense and sparse backends")
+    parser.add_argument("--frame-start", type=int, help="only render from this frame (needs --output)")
+    parser.add_argument("--frame-end", type=int, help="only render up to this frame (needs --output)")
+    parser.add_argument("--output", help="render the animation to this path")
+    parser.add_argument("--save", help="save the .blend file here once the animation is built")
+    parser.add_argument("--frame-budget", type=int,
+                        help="squeeze the animation into at most this many frames (see plan_compressed_keyframes())")
+    parser.add_argument("--captions", action="store_true",
+                        help="show what each move is doing in the text object while it plays")
+    parser.add_argument("--stats", help="count and time the build, and write the stats to this file "
+                                        "(as a cProfile .prof file if it ends in .prof, otherwise as JSON)")
+    parser.add_argument("--check", action="store_true",
+                        help="check the keyframes are a legal solution with check_keyframe_arrays() (needs NumPy)")
+    options = parser.parse_args(arguments)
+
+    if options.frame_start is not None or options.frame_end is not None:
+        if options.output is None or options.frame_start is None or options.frame_end is None:
+            parser.error("--frame-start and --frame-end need each other and --output")
+        # A chunk is always the plain 3 tower animation from plan_sparse_keyframes(), so
+        # anything asking for a different one can't be done this way.
+        if (options.pegs != 3 or options.backend is not None or options.frame_budget is not None
+                or options.captions or options.check or options.stats or options.cache or options.save):
+            parser.error("--frame-start and --frame-end don't work with --pegs, --backend, --frame-budget, "
+                         "--captions, --check, --stats, --cache or --save")
+        render_chunk(options.height, options.frame_rate, options.frame_start, options.frame_end, options.output)
+        return
+    if options.backend is None:
+        options.backend = "per_move"
+    problem = animation_options_problem(options.pegs, options.backend, options.frame_budget, options.captions,
+                                        options.check, options.cache)
+    if problem is not None:
+        parser.error(problem)
+
+    # And now we create our hanoi object, and then call move_tower() with our height
+    # and the names of the towers (any name will work as long as they are unique).
+    #
+    # move_tower_bulk() builds the same animation much faster; the time each one took
+    # gets printed to the console.
+    hanoi_object = hanoi(options.height, frame_rate=options.frame_rate, pegs=options.pegs)
+    if options.stats:
+        hanoi_object.enable_stats()
+    build_animation(hanoi_object, options.height, options.backend, options.pegs, options.frame_budget, options.cache)
+    print ("Built the animation in " + str(hanoi_object.build_seconds) + " seconds.")
+
+    if options.stats:
+        print (hanoi_object.stats.text())
+        if options.stats.endswith(".prof"):
+            hanoi_object.stats.write_pstats(options.stats)
+        else:
+            with open(options.stats, "w") as stats_file:
+                hanoi_object.stats.write_json(stats_file)
+
+    if options.captions:
+        pole_names = all_pole_names[:options.pegs]
+        hanoi_object.show_captions(frame_stewart_moves(options.height, pole_names[0], pole_names[1], pole_names[2:]))
+
+    if options.check:
+        problem = check_keyframe_arrays(read_keyframe_tracks(options.height), pole_numbers["tower_a"],
+                                        pole_numbers["tower_b"], hanoi_object.geometry)
+        if problem is None:
+            print ("The keyframes are a legal solution.")
+        else:
+            print ("Frame " + str(problem[0]) + ": " + problem[1])
+
+    scene = bpy.context.scene
+    if options.save:
+        bpy.ops.wm.save_as_mainfile(filepath=options.save)
+    if options.output:
+        scene.frame_start = 0
+        scene.frame_end = hanoi_object.frame_count
+        scene.render.filepath = options.output
+        bpy.ops.render.render(animation=True)
+
+if __name__ == "__main__":
+    main()